@@ -5,13 +5,18 @@
 # pycalc - python one-liner
 #
 
+import time
+_t0 = time.perf_counter()
 import io, sys, os
 import re
 import argparse
-import datetime
-import numpy as np
-import pandas as pd
-import unicodedata
+import ast
+import importlib, importlib.util
+import csv, functools, json, marshal, struct
+## numpy and pandas are imported in __main__ (skipped by --connect client)
+## hashlib, concurrent.futures, multiprocessing and socket modules are
+## imported where used (--cache, --batch, --jobs, --serve/--connect)
+## datetime, unicodedata, matplotlib and -m modules are imported lazily
 
 _version = "Mon Jun 1 16:48:17 JST 2024"
 _code    = "MyCommands(LINUX+WINDOWS/PYTHON3/UTF-8)"
@@ -29,10 +34,54 @@ elif os.name == 'posix':
 def raise_error(msg, *arg):
     scriptfile = os.path.basename(__file__)
     errorheader = "Error[" + scriptfile + "]:"
-    print(errorheader, msg.format(arg), file=sys.stderr)
+    print(errorheader, msg.format(*arg), file=sys.stderr)
     sys.exit(1)
 
-def get_args():
+## lazy import (--profile-startup prints import times)
+_import_times = []
+
+def timed_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    t = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_times.append((name, time.perf_counter() - t))
+    return module
+
+class LazyModule:
+    ## import module on first attribute access
+    def __init__(self, name, imports=(), attr=None, setup=None):
+        self.__dict__['_lazy'] = (name, imports, attr, setup)
+        self.__dict__['_module'] = None
+    def _load(self):
+        if self._module is None:
+            name, imports, attr, setup = self._lazy
+            for sub in imports:
+                timed_import(sub)
+            module = timed_import(name)
+            if setup:
+                setup(module)
+            self.__dict__['_module'] = getattr(module, attr) if attr else module
+        return self._module
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+    def __getitem__(self, key):
+        return self._load()[key]
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+    def __dir__(self):
+        return dir(self._load())
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '{0}'>".format(self._lazy[0])
+        return repr(self._module)
+
+datetime    = LazyModule('datetime')
+unicodedata = LazyModule('unicodedata')
+
+def get_args(argv=None):
     help_desc_msg = r"""pycalc.py -- python oneliner
 
     pycalc.py <formula;formura;...>
@@ -42,10 +91,11 @@ def get_args():
     -i <file>でファイル入力も可能
 
     <formula>はセミコロン区切りで複数指定可能
-    formulaに"="が含まれておればexec(formula),
-    含まれないならans=eval(formula)が実行される
-    ただし、()の中だけにイコールがある場合はevalになる。
-    たとえば"df.describe(include='all')"はeval
+    formulaはastで一度だけ解析・コンパイルされ、
+    代入などの文はexec(formula), 式はans=eval(formula)で評価して出力する
+    たとえば"df.describe(include='all')"や"df[df.a=='x']"はeval
+    文字列中のセミコロンも使用可能: "x='a;b';x"
+    --cacheを付けるとコンパイル結果をディスクに保存して再利用する
 
     -v '<val1>=<str>;<val2>=<str>;...'で変数に代入できる
 
@@ -71,6 +121,9 @@ def get_args():
     cat date.txt | python pycalc.py "df['date']=pd.to_datetime(df['date']);df['add_date']=df['date']+pd.to_timedelta(df['val'], unit='d');df"
 
     ## normalise using str.unicodedata.normalize('NKFC')
+    ## --normalizeは文字列の列だけを.str.normalize('NFKC')で正規化する
+    ## (重複する値は一度だけ正規化) 型推定は正規化の後に行うので
+    ## 全角数字の列は数値になる
     cat date.txt | python pycalc.py "df" --normalize
     cat date.txt | python pycalc.py "df=df.applymap(lambda x: unicodedata.normalize('NFKC',x));df"
     cat date.txt | python pycalc.py "df['ten']=df['ten'].str.normalize('NFKC');df"
@@ -125,7 +178,10 @@ def get_args():
     ([0, 1, 2, 3, 4, 5], [0, 1, 4, 9, 16, 25])
 
     === Matplotlibを用いたグラフ描画 ===
-    ## formulaに"plot"または"plt"をみつけるとimport matplotlib as pltを読み込む
+    ## plt(matplotlib.pyplot)とrcParamsは最初に使われたときにimportされる
+    ## formulaにdf.plot/df.hist/df.boxplotがあれば事前にフォントなどを設定する
+    ## datetime, unicodedata, -mで指定したモジュールも最初に使われたときにimportされる
+    ## --profile-startupでimportごとの時間をstderrに出力
     cat iris.csv | python pycalc.py -d "," "ax=df.groupby('species').max().plot.bar(rot=0);plt.show()"
 
     echo 1 | python pycalc.py 'plt.plot(s,t);plt.show()' -v 's=[i for i in range(6)];t=[i**2 for i in s]'
@@ -157,6 +213,80 @@ def get_args():
     cat iris.csv | python pycalc.py -d "," "df.columns=['sl','sw','pl','pw','species'];df.query('sl > 5.0 & sw < 2.5')"
     cat iris.csv | python pycalc.py -d "," "df.columns=['sl','sw','pl','pw','species'];df.query('sl > 5.0 and sw < 2.5')"
 
+    === dtype hints and lean parsing options ===
+    ## 型や読み込む列を指定してメモリを節約する(read_csvに渡される)
+    ## --memoryでデフォルトの読み込みとのdf.memory_usage(deep=True)を比較(stderr)
+    cat iris.csv | python pycalc.py -d "," "df.dtypes" --dtype sepal_length:float32,sepal_width:float32
+    cat iris.csv | python pycalc.py -d "," "df.dtypes" --usecols sepal_length,species --category species
+    cat iris.csv | python pycalc.py -d "," "df.dtypes" --engine pyarrow --dtype-backend pyarrow
+    cat iris.csv | python pycalc.py -d "," "df.shape" --category species --dtype sepal_length:float32 --memory
+
+    === chunked streaming (--chunksize N) ===
+    ## 入力をN行ずつ読み込み、チャンクごとに式を評価する
+    ## 集計式(sum/count/size/min/max/mean/agg/describe)は最後に部分結果を結合して出力
+    ## 行単位の式(df, df[...], query, assign, fillna, str/dt...)はチャンクごとに逐次出力
+    ## それ以外の式は警告を出して全体を読み込んでから評価する
+    ## (df[df.a > df.a.mean()], df.fillna(df.mean()), groupby(..., as_index=False)など)
+    ## (query/evalの文字列も検査する. lambdaはapply/mapの要素単位または行単位のみ)
+    ## 注意: ";"区切りの代入文はチャンクごとに独立して実行される
+    ##       行単位または定数の値を代入する文のみ(df['z']=df.a*2など)
+    ## 注意: groupbyなしのdescribeは使用する列の全チャンクをメモリに保持する
+    cat big.csv | python pycalc.py -d "," "df.groupby('species').mean()" --chunksize 100000
+    cat big.csv | python pycalc.py -d "," "df.groupby('species').agg({'sl':'mean', 'sw':max})" --chunksize 100000
+    cat big.csv | python pycalc.py -d "," "df.query('sl > 5.0')" --chunksize 100000
+    cat big.csv | python pycalc.py -d "," "df" --csv --chunksize 100000
+
+    === fast csv/tsv/ssv output (--csv/--tsv/--ssv) ===
+    ## テキストラッパーを通さずstdout.bufferに大きなブロック単位で書き出す
+    ## --write-rows N: 1ブロックの行数, --chunksizeと併用するとチャンクごとに書き出す
+    ## --write-engine pyarrow: pyarrow.csvで書き出す(要pyarrow, 引用符や数値の書式が異なる場合あり)
+    ## --bench-write: 従来の出力と比較したrows/secをstderrに出力
+    cat big.csv | python pycalc.py -d "," "df" --tsv > big.tsv
+    cat big.csv | python pycalc.py -d "," "df" --csv --chunksize 100000 --write-rows 50000 > out.csv
+    cat big.csv | python pycalc.py -d "," "df" --csv --write-engine pyarrow --bench-write > /dev/null
+
+    === multiprocess parallel groupby/apply (--jobs N) ===
+    ## dfを分割してN個のプロセスで式を評価し、結果を順に結合する
+    ## 行単位の式(df['col'].apply(f), query, str...)は行の範囲で分割
+    ## df.groupby('<key>').<func>()はグループのキーで分割
+    ## 分割できない式は1プロセスで評価する (--jobs 0: CPU数)
+    ## (df[df.a > df.a.mean()]やdfから代入した変数を使う式など)
+    cat iris.csv | python pycalc.py -d "," "df.groupby('species').agg(lambda x: max(x) - min(x))" --jobs 4
+    cat date.txt | python pycalc.py "df['len']=df['ten'].apply(len);df" --jobs 4
+
+    === batch mode (--batch FILE) ===
+    ## 一度だけ読み込んだdfに対して、ファイルに書いた複数の式をそれぞれ評価する
+    ## テキスト: 1行に"<name>: <formula>" (nameは省略可, #はコメント)
+    ## json: {"<name>": "<formula>", ...} or [{"name":..., "formula":..., "output":...}, ...]
+    ## 結果は"==> <name> <=="区切りで標準出力、または--batch-outdir <dir>に<name>.txtで出力
+    ## dfを変更しない式は--batch-threads Nでスレッド並列に実行する
+    ## (dfを変更する式はdfのコピーに対して順に実行される)
+    $ cat report.txt
+    size: df.groupby('species').size()
+    mean: df.groupby('species').mean()
+    big:  df['area']=df['sl']*df['sw']; df.query('area > 20')
+    cat iris.csv | python pycalc.py -d "," --batch report.txt
+    cat iris.csv | python pycalc.py -d "," --batch report.txt --batch-threads 4 --batch-outdir out
+
+    === cache parsed input file (--cache) ===
+    ## -i <file>の読み込み結果をpickleで~/.cache/pycalcに保存し、2回目以降は再利用する
+    ## キー: ファイルパス, サイズ, 更新日時, 区切り文字, --noheader/--index/--datetime
+    ## 合計サイズが--cache-size MB(default: 1024)を超えると古いものから削除
+    python pycalc.py -i big.csv -d "," "df.describe()" --cache
+    python pycalc.py -i big.csv -d "," "df.groupby('species').size()" --cache
+    python pycalc.py -i big.csv -d "," "df.shape" --cache --no-cache
+    python pycalc.py --clear-cache
+
+    === warm worker daemon (--serve / --connect) ===
+    ## numpy, pandasをimport済みのデーモンをunix socketで待ち受けさせ、
+    ## --connectを付けた呼び出しは標準入力と引数をデーモンに転送して結果を受け取る
+    ## (クライアント側はnumpy, pandasをimportしない)
+    ## リクエストごとにfork()するので、dfや変数はコールドスタートと同じく毎回新しい
+    ## socket: --socket <path> (default: $TMPDIR/pycalc-<uid>/pycalc.sock)
+    ## socketはmode 0600で作成し、自分が所有するsocketにのみ接続する
+    python pycalc.py --serve &
+    cat iris.csv | python pycalc.py -d "," "df.describe()" --connect
+
     === solve simultaneous equations ===
     echo 1 | python pycalc.py 'L=[[3/4,5/2], [-2,1]];R=[-6,-7];np.linalg.solve(L, R)'
     [ 2. -3.]
@@ -166,7 +296,7 @@ def get_args():
                     formatter_class=argparse.RawDescriptionHelpFormatter)
     tp = lambda x:list(map(str, x.split(',')))
     sp = lambda x:list(map(str, x.split(';')))
-    parser.add_argument("formula", help="python script", type=str)
+    parser.add_argument("formula", help="python script", type=str, nargs='?')
     parser.add_argument("-i", "--inputfile", help="input file name", type=str)
     parser.add_argument("-d", "--delimiter", help="line separator(delimiter)", default=r' ',
         choices=[r" ", r",", r"\t"])
@@ -177,17 +307,47 @@ def get_args():
     parser.add_argument("--index", help="col[0] as index", action="store_true")
     parser.add_argument("--datetime", help="set df.columns[0] as datetime", action="store_true")
     parser.add_argument("--nowrap", help="human readable for terminal", action="store_true")
-    parser.add_argument("--normalize", help="normalize data using unicodedata.normalize('NFKC')", action="store_true")
+    parser.add_argument("--normalize", help="normalize str data using NFKC before type inference", action="store_true")
     parser.add_argument("--csv", help="output df as csv to stdout", action="store_true")
     parser.add_argument("--tsv", help="output df as tsv to stdout", action="store_true")
     parser.add_argument("--ssv", help="output df as ssv to stdout", action="store_true")
+    parser.add_argument("--write-engine", help="csv writer for --csv/--tsv/--ssv", default='pandas',
+        choices=['pandas', 'pyarrow'])
+    parser.add_argument("--write-rows", help="rows per block written by --csv/--tsv/--ssv", default=None, type=int)
+    parser.add_argument("--bench-write", help="print rows/sec of csv writers to stderr", action="store_true")
     parser.add_argument("--max_rows", help="max rows", default=None, type=int)
     parser.add_argument("--max_columns", help="max colmnss", default=None, type=int)
     parser.add_argument("--max_colwidth", help="max column width", default=None, type=int)
     parser.add_argument('--size', help='graph size: w inch, h inch', type=tp)
+    parser.add_argument("--dtype", help="dtype hints: col:type,...", type=tp)
+    parser.add_argument("--usecols", help="read only these columns: col,...", type=tp)
+    parser.add_argument("--category", help="read columns as category: col,...", type=tp)
+    parser.add_argument("--engine", help="read_csv parser engine", default=None,
+        choices=["c", "python", "pyarrow"])
+    parser.add_argument("--dtype-backend", help="read_csv dtype backend", default=None,
+        choices=["numpy_nullable", "pyarrow"])
+    parser.add_argument("--memory", help="print memory usage of default and lean read to stderr", action="store_true")
+    parser.add_argument("--chunksize", help="read and calc input by N rows (streaming)", default=None, type=int)
+    parser.add_argument("--jobs", help="processes for parallel groupby/apply (0: cpu count)", default=1, type=int)
+    parser.add_argument("--batch", help="run formulas in file against one df", default=None, type=str)
+    parser.add_argument("--batch-outdir", help="write each batch result to <dir>/<name>.txt", default=None, type=str)
+    parser.add_argument("--batch-threads", help="threads for batch formulas that do not mutate df", default=1, type=int)
+    parser.add_argument("--cache", help="cache parsed input file (-i) on disk", action="store_true")
+    parser.add_argument("--no-cache", help="do not use cache", action="store_true")
+    parser.add_argument("--clear-cache", help="remove all cache files", action="store_true")
+    parser.add_argument("--cache-dir", help="cache directory (default: ~/.cache/pycalc)", default=None, type=str)
+    parser.add_argument("--cache-size", help="max total cache size in MB", default=1024, type=int)
+    parser.add_argument("--serve", help="run as warm worker daemon on unix socket", action="store_true")
+    parser.add_argument("--connect", help="send request to warm worker daemon", action="store_true")
+    parser.add_argument("--socket", help="unix socket path for --serve/--connect", default=None, type=str)
+    parser.add_argument("--profile-startup", help="print import times to stderr", action="store_true")
     parser.add_argument("--debug", help="output dataframe", action="store_true")
     #parser.print_help()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.formula is None and not (args.serve or args.clear_cache or args.batch):
+        parser.error("the following arguments are required: formula")
+    if args.formula is not None and args.batch:
+        parser.error("formula can not be used with --batch (add it to the batch file)")
     return(args)
 
 def __get_values(vals):
@@ -203,32 +363,1187 @@ def open_file():
         readfile = sys.stdin
     return readfile
 
-if __name__ == '__main__':
+def get_colname(col):
+    ## with --noheader, columns are numbers
+    col = str(col).strip()
+    if args.noheader and col.isdigit():
+        return int(col)
+    return col
 
-    # get args
-    args = get_args()
+def get_dtype_hints():
+    ## --dtype col:type,... and --category col,...
+    hints = {}
+    if args.dtype:
+        for item in args.dtype:
+            if ':' not in item:
+                raise_error("Invalid --dtype (col:type): {0}", item)
+            col, typ = item.rsplit(':', 1)
+            hints[get_colname(col)] = typ.strip()
+    if args.category:
+        for col in args.category:
+            hints[get_colname(col)] = 'category'
+    return hints
+
+def get_read_options(lean=True):
+    ## tab is passed as is, so that c/pyarrow engine can be used
+    sep = '\t' if args.delimiter == r'\t' else args.delimiter
+    opts = {'sep': sep}
+    if args.noheader:
+        opts['header'] = None
+    if args.index:
+        opts['index_col'] = 0
+    elif args.datetime:
+        opts['index_col'] = 0
+        opts['parse_dates'] = True
+    if lean:
+        ## dtype hints and lean parsing options
+        if get_dtype_hints():
+            opts['dtype'] = get_dtype_hints()
+        if args.usecols:
+            opts['usecols'] = [get_colname(col) for col in args.usecols]
+        if args.engine:
+            if args.engine == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+                raise_error("--engine pyarrow requires pyarrow")
+            opts['engine'] = args.engine
+        if args.dtype_backend:
+            if args.dtype_backend == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+                raise_error("--dtype-backend pyarrow requires pyarrow")
+            opts['dtype_backend'] = args.dtype_backend
+    if args.normalize:
+        ## read as str and infer types after normalization
+        opts['dtype'] = str
+        opts.pop('parse_dates', None)
+    return opts
 
-    # import matplotlib
-    if re.search(r'plot|plt', args.formula):
-        import matplotlib.pyplot as plt
-        from matplotlib import rcParams
-        plt.rcParams['font.family'] = 'sans-serif'
-        ## on windows
-        if os.name == 'nt':
-            plt.rcParams['font.sans-serif'] = ['IPAexGothic', 'BIZ UDGothic', 'MS Gothic', 'Yu Gothic', 'Noto Sans CJK JP']
-        plt.rcParams['pdf.fonttype'] = 42
-        plt.rcParams['ps.fonttype'] = 42
-        ## set figure size
-        if args.size:
-            if len(args.size) == 1:
-                w_inch = args.size[0]
-                h_inch = args.size[0]
+def print_memory_usage(label, df):
+    usage = df.memory_usage(deep=True)
+    print("memory usage ({0}): {1:,} bytes".format(label, usage.sum()), file=sys.stderr)
+    print(usage.to_string(), file=sys.stderr)
+
+## output df as csv/tsv/ssv (--csv/--tsv/--ssv)
+##   write encoded blocks directly to the binary buffer of stdout
+def get_output_sep():
+    if args.tsv:
+        return "\t"
+    if args.ssv:
+        return " "
+    return ","
+
+def write_table(df, header=True, out=None, engine=None):
+    engine = engine or args.write_engine
+    if out is None:
+        sys.stdout.flush()
+        out = getattr(sys.stdout, 'buffer', None)
+        if out is None:
+            ## stdout is redirected to a text stream
+            df.to_csv(sys.stdout, index=True, sep=get_output_sep(), header=header)
+            return
+    if engine == 'pyarrow':
+        write_table_pyarrow(df, header, out)
+    else:
+        df.to_csv(out, index=True, sep=get_output_sep(), header=header,
+            encoding='utf-8', chunksize=args.write_rows)
+    out.flush()
+
+def write_table_pyarrow(df, header, out):
+    try:
+        pa = importlib.import_module('pyarrow')
+        pa_csv = importlib.import_module('pyarrow.csv')
+    except ImportError:
+        raise_error("--write-engine pyarrow requires pyarrow")
+    ## index is written as the first column(s) like df.to_csv()
+    names = [str(n) if n is not None else '' for n in df.index.names]
+    frame = df.reset_index()
+    frame.columns = names + [str(c) for c in df.columns]
+    if len(set(frame.columns)) != len(frame.columns):
+        ## pyarrow needs unique column names
+        df.to_csv(out, index=True, sep=get_output_sep(), header=header, encoding='utf-8')
+        return
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    opts = pa_csv.WriteOptions(include_header=header, delimiter=get_output_sep(),
+        batch_size=args.write_rows or 1024)
+    pa_csv.write_csv(table, out, write_options=opts)
+
+def bench_write(df):
+    ## compare rows/sec of to_csv through the text wrapper and write_table
+    writers = [('to_csv(text)', 'w', lambda f: df.to_csv(f, index=True, sep=get_output_sep())),
+               ('pandas(binary)', 'wb', lambda f: write_table(df, out=f, engine='pandas'))]
+    if importlib.util.find_spec('pyarrow') is not None:
+        writers.append(('pyarrow(binary)', 'wb', lambda f: write_table(df, out=f, engine='pyarrow')))
+    print("write benchmark: {0:,} rows x {1} cols".format(len(df), len(df.columns)), file=sys.stderr)
+    for label, mode, writer in writers:
+        with open(os.devnull, mode) as f:
+            t = time.perf_counter()
+            writer(f)
+            sec = time.perf_counter() - t
+        print("  {0:<18}{1:8.3f} s {2:14,.0f} rows/s".format(label, sec, len(df) / sec if sec else 0),
+            file=sys.stderr)
+
+## on-disk cache of parsed dataframe (--cache)
+##   key: path, size, mtime, read_csv options, pandas version
+def get_cache_dir():
+    if args.cache_dir:
+        return re.sub(r'\\', '/', args.cache_dir)
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pycalc')
+
+def get_cache_path(readfile, opts):
+    import hashlib
+    st = os.stat(readfile)
+    key = [os.path.abspath(readfile), st.st_size, st.st_mtime_ns,
+           sorted(opts.items()), pd.__version__]
+    key = json.dumps(key, default=str)
+    return os.path.join(get_cache_dir(), hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+
+def clear_cache():
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name.endswith(('.pkl', '.code')):
+            os.remove(os.path.join(cache_dir, name))
+
+def evict_cache():
+    ## remove least recently used files until total size <= --cache-size MB
+    cache_dir = get_cache_dir()
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(('.pkl', '.code')):
+            path = os.path.join(cache_dir, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+    total = sum(f[1] for f in files)
+    limit = args.cache_size * 1024 * 1024
+    for mtime, size, path in sorted(files):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
+
+def read_dataframe(readfile, opts):
+    if not args.cache or args.no_cache or not isinstance(readfile, str):
+        return pd.read_csv(readfile, **opts)
+    cache_path = get_cache_path(readfile, opts)
+    if os.path.exists(cache_path):
+        try:
+            df = pd.read_pickle(cache_path)
+            ## mark as recently used
+            os.utime(cache_path)
+            return df
+        except Exception:
+            pass
+    df = pd.read_csv(readfile, **opts)
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        tmp_path = cache_path + '.{}.tmp'.format(os.getpid())
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+        evict_cache()
+    except OSError as e:
+        print("Warning: could not write cache: {0}".format(e), file=sys.stderr)
+    return df
+
+## unicode normalization (--normalize)
+##   only str columns are normalized, each unique value once
+def normalize_values(values):
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+    is_str = uniques.map(type) == str
+    normalized = uniques.where(~is_str, uniques[is_str].str.normalize('NFKC'))
+    ## map back via codes (-1: NaN)
+    out = np.append(normalized.to_numpy(dtype=object), np.nan)[codes]
+    return out
+
+def infer_values(frame):
+    ## infer types of the normalized str values with the csv parser, as a
+    ## normal read does (full width digits become numbers, True/False bool)
+    if frame.empty:
+        return frame
+    buf = io.StringIO()
+    frame.to_csv(buf, header=False, index=False, quoting=csv.QUOTE_NONNUMERIC)
+    buf.seek(0)
+    opts = {'dtype_backend': args.dtype_backend} if args.dtype_backend else {}
+    out = pd.read_csv(buf, header=None, names=range(frame.shape[1]), **opts)
+    out.columns = frame.columns
+    out.index = frame.index
+    return out
+
+def normalize_dataframe(df):
+    cols = [i for i, col in enumerate(df.columns)
+            if df.iloc[:, i].dtype == object or pd.api.types.is_string_dtype(df.iloc[:, i])]
+    if cols:
+        normalized = pd.DataFrame({i: normalize_values(df.iloc[:, i]) for i in cols}, index=df.index)
+        inferred = infer_values(normalized)
+        for i in cols:
+            df.isetitem(i, inferred[i])
+    if df.index.dtype == object:
+        index = pd.Index(normalize_values(df.index), name=df.index.name)
+        if args.datetime:
+            try:
+                index = pd.DatetimeIndex(pd.to_datetime(index), name=df.index.name)
+            except (ValueError, TypeError):
+                pass
+        else:
+            index = pd.Index(infer_values(pd.DataFrame({0: index}))[0], name=df.index.name)
+        df.index = index
+    ## apply dtype hints after type inference
+    hints = {col: typ for col, typ in get_dtype_hints().items() if col in df.columns}
+    if hints:
+        df = df.astype(hints)
+    return df
+
+def parse_formula(formula):
+    ## returns [(is_exec, node), ...]
+    ## consecutive statements are grouped into one exec code,
+    ## each expression is evaluated and printed
+    tree = ast.parse(str(formula).strip())
+    pieces = []
+    stmts = []
+    for node in tree.body:
+        if isinstance(node, ast.Expr):
+            if stmts:
+                pieces.append((True, ast.Module(body=stmts, type_ignores=[])))
+                stmts = []
+            pieces.append((False, ast.Expression(body=node.value)))
+        else:
+            stmts.append(node)
+    if stmts:
+        pieces.append((True, ast.Module(body=stmts, type_ignores=[])))
+    return pieces
+
+def compile_formula(formula):
+    ## returns [(is_exec, code), ...]
+    ## with --cache, compiled codes are saved by marshal
+    ##   key: formula, python version
+    use_cache = args.cache and not args.no_cache
+    if use_cache:
+        import hashlib
+        key = json.dumps([str(formula), sys.version])
+        cache_path = os.path.join(get_cache_dir(), hashlib.sha1(key.encode('utf-8')).hexdigest() + '.code')
+        try:
+            with open(cache_path, 'rb') as f:
+                codes = marshal.load(f)
+            os.utime(cache_path)
+            return codes
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    try:
+        codes = [(is_exec, compile(node, '<formula>', 'exec' if is_exec else 'eval'))
+                 for is_exec, node in parse_formula(formula)]
+    except SyntaxError as e:
+        raise_error("Formula syntax error: {0}", e)
+    if use_cache:
+        try:
+            os.makedirs(get_cache_dir(), exist_ok=True)
+            tmp_path = cache_path + '.{}.tmp'.format(os.getpid())
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(codes, f)
+            os.replace(tmp_path, cache_path)
+            evict_cache()
+        except OSError as e:
+            print("Warning: could not write cache: {0}".format(e), file=sys.stderr)
+    return codes
+
+def run_formula(formula=None, ns=None, file=None, codes=None):
+    ## codes: result of compile_formula() (--batch compiles before running)
+    if formula is None:
+        formula = args.formula
+    if ns is None:
+        ns = globals()
+    if codes is None:
+        codes = compile_formula(formula)
+    for is_exec, code in codes:
+        if is_exec:
+            exec(code, ns)
+        else:
+            ans = eval(code, ns)
+            if args.quiet:
+                pass
             else:
-                w_inch = args.size[0]
-                h_inch = args.size[1]
-            plt.rcParams['figure.figsize'] = (w_inch, h_inch)
-            debStr = "plt.rcParams['figure.figsize'] = ({}, {})".format(w_inch, h_inch)
-            if args.debug: print(debStr)
+                print(ans, file=file)
+
+## batch mode (--batch FILE)
+##   text: "<name>: <formula>" per line (name is optional)
+##   json: {"<name>": "<formula>", ...} or [{"name":, "formula":, "output":}, ...]
+def read_batch(path):
+    path = re.sub(r'\\', '/', path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except OSError as e:
+        raise_error("Could not open batch file: {0}", e)
+    jobs = []
+    if path.endswith('.json'):
+        try:
+            entries = json.loads(text)
+        except ValueError as e:
+            raise_error("Invalid batch file: {0}: {1}", path, e)
+        if isinstance(entries, dict):
+            entries = [{'name': k, 'formula': v} for k, v in entries.items()]
+        if not isinstance(entries, list):
+            raise_error("Invalid batch file: {0}: expected a list or an object", path)
+        for i, entry in enumerate(entries, 1):
+            if not (isinstance(entry, dict) and isinstance(entry.get('formula'), str)):
+                raise_error("Invalid batch file: {0}: entry {1} has no \"formula\" string", path, i)
+            jobs.append((str(entry.get('name', 'formula{0}'.format(i))),
+                         entry['formula'], entry.get('output')))
+        return jobs
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        m = re.search(r'^([\w.-]+)\s*:\s+(.*)$', line)
+        if m:
+            jobs.append((m.group(1), m.group(2), None))
+        else:
+            jobs.append(('formula{0}'.format(len(jobs) + 1), line, None))
+    return jobs
+
+def formula_mutates_df(formula):
+    ## True if formula may change the shared df in place
+    ## (rebinding "df = ..." is not a mutation)
+    for node in ast.walk(ast.parse(formula)):
+        if isinstance(node, (ast.Assign, ast.Delete)):
+            targets = node.targets
+        elif isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+            targets = [node.target]
+        elif isinstance(node, ast.Call):
+            if any(k.arg == 'inplace' for k in node.keywords):
+                return True
+            if isinstance(node.func, ast.Attribute) and node.func.attr in ('insert', 'pop', 'update'):
+                return True
+            continue
+        else:
+            continue
+        for target in targets:
+            if any(isinstance(n, (ast.Subscript, ast.Attribute)) for n in ast.walk(target)):
+                return True
+    return False
+
+def run_batch_job(name, formula, codes, mutates):
+    buf = io.StringIO()
+    ns = dict(globals())
+    ns['df'] = df.copy() if mutates else df
+    ns['print'] = functools.partial(print, file=buf)
+    try:
+        run_formula(formula, ns, buf, codes)
+        ok = True
+    except Exception as e:
+        print("Error[{0}]: batch {1}: {2}".format(os.path.basename(__file__), name, repr(e)), file=sys.stderr)
+        ok = False
+    return buf.getvalue(), ok
+
+def run_batch():
+    import concurrent.futures
+    jobs = read_batch(args.batch)
+    if any(uses_pandas_plot(formula) for name, formula, output in jobs):
+        plt._load()
+    ## compile all formulas before running
+    codes = [compile_formula(formula) for name, formula, output in jobs]
+    mutates = [formula_mutates_df(formula) for name, formula, output in jobs]
+    results = [None] * len(jobs)
+    ## formulas that do not mutate df share the frame in a thread pool,
+    ## others run serially with their own copy
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.batch_threads) as pool:
+        futures = {}
+        for i, (name, formula, output) in enumerate(jobs):
+            if not mutates[i]:
+                futures[i] = pool.submit(run_batch_job, name, formula, codes[i], False)
+        for i, (name, formula, output) in enumerate(jobs):
+            if mutates[i]:
+                results[i] = run_batch_job(name, formula, codes[i], True)
+        for i, future in futures.items():
+            results[i] = future.result()
+    ## write results
+    for i, ((name, formula, output), (text, ok)) in enumerate(zip(jobs, results)):
+        if output is None and args.batch_outdir:
+            output = os.path.join(args.batch_outdir, name + '.txt')
+        if output:
+            if os.path.dirname(output):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            if i > 0:
+                print()
+            print("==> {0} <==".format(name))
+            sys.stdout.write(text)
+    if not all(ok for text, ok in results):
+        sys.exit(1)
+
+## chunked streaming evaluation (--chunksize)
+##   reduce: partial results of each chunk are combined at the end
+##   row:    results are printed chunk by chunk
+_CHUNK_REDUCERS = ('sum', 'count', 'size', 'min', 'max', 'mean', 'agg', 'aggregate', 'describe')
+_CHUNK_ROWWISE  = ('query', 'assign', 'dropna', 'fillna', 'replace', 'astype', 'round', 'abs',
+                   'isna', 'notna', 'isnull', 'notnull', 'rename', 'map', 'applymap',
+                   'to_datetime', 'where', 'mask', 'clip', 'between', 'isin')
+_CHUNK_AGGFUNCS = {'sum': 'sum', 'count': 'count', 'size': 'size',
+                   'min': 'min', 'max': 'max', 'mean': 'mean',
+                   'amin': 'min', 'amax': 'max'}
+
+_CHUNK_FUNCS    = ('where', 'to_datetime', 'to_numeric', 'isna', 'notna', 'isnull', 'notnull')
+_CHUNK_BUILTINS = ('abs', 'round')
+## methods returning a frame with the rows of the receiver frame
+_CHUNK_FRAMES   = ('query', 'assign', 'dropna', 'fillna', 'replace', 'astype', 'round', 'abs',
+                   'rename', 'map', 'applymap', 'where', 'mask', 'clip')
+## methods calling a function per element, row (axis=1) or label
+_CHUNK_CALLBACK = ('apply', 'map', 'applymap', 'rename')
+
+def _chunk_join(kinds):
+    ## 'row' if any part is row-wise, None if any part is not chunk-safe
+    kinds = list(kinds)
+    if None in kinds:
+        return None
+    return 'row' if 'row' in kinds else 'const'
+
+def _chunk_frame(node, names):
+    ## True if node is a frame with the rows of the chunk:
+    ## df, df[['a', 'b']], df[mask], df.query(...), df.assign(...), ...
+    if isinstance(node, ast.Name):
+        return node.id == 'df'
+    if isinstance(node, ast.Subscript):
+        if not _chunk_frame(node.value, names):
+            return False
+        if isinstance(node.slice, (ast.List, ast.Tuple)):
+            return _chunk_kind(node.slice, names) == 'const'
+        return _chunk_kind(node.slice, names) == 'row'
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return node.func.attr in _CHUNK_FRAMES and _chunk_frame(node.func.value, names)
+    return False
+
+def _chunk_query(node, names):
+    ## df.query('a > 1'), df.eval('a + b'): parse the expression string.
+    ## bare names are columns, @name is a variable
+    if len(node.args) != 1 or not (isinstance(node.args[0], ast.Constant)
+                                   and isinstance(node.args[0].value, str)):
+        return False
+    text = re.sub(r'`[^`]*`', '_chunk_column', node.args[0].value)
+    text = re.sub(r'@([A-Za-z_]\w*)', r'_chunk_var_\1', text)
+    try:
+        tree = ast.parse(text.strip())
+    except SyntaxError:
+        return False
+    qnames = {}
+    for n in ast.walk(tree):
+        if isinstance(n, ast.Name):
+            if n.id.startswith('_chunk_var_'):
+                qnames[n.id] = names.get(n.id[len('_chunk_var_'):], 'const')
+            else:
+                qnames[n.id] = 'row'
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Expr):
+            value = stmt.value
+        elif isinstance(stmt, ast.Assign) and all(isinstance(t, ast.Name) for t in stmt.targets):
+            value = stmt.value
+        else:
+            return False
+        if _chunk_kind(value, qnames) is None:
+            return False
+    return True
+
+def _chunk_kind(node, names):
+    ## 'row':   row-wise result computed from df (same rows as the chunk)
+    ## 'const': does not depend on df (literals, variables, np.nan, lambda)
+    ## None:    depends on other rows (reductions, sort, shift, positions, ...)
+    ## names: {name: 'row' or None} for df and variables assigned from df
+    if isinstance(node, ast.Constant):
+        return 'const'
+    if isinstance(node, ast.Name):
+        return names.get(node.id, 'const')
+    if isinstance(node, ast.Attribute):
+        kind = _chunk_kind(node.value, names)
+        if kind != 'row':
+            return kind
+        ## the .str/.dt accessors (not df.shape, df.T, df.loc, ...)
+        if node.attr in ('str', 'dt'):
+            return 'row'
+        ## df.col (on a Series, s.label is an index lookup)
+        if _chunk_frame(node.value, names) and not hasattr(pd.DataFrame, node.attr):
+            return 'row'
+        return None
+    if isinstance(node, ast.Subscript):
+        kind = _chunk_kind(node.value, names)
+        if kind is None or isinstance(node.slice, ast.Slice):
+            ## df[0:5] is positional
+            return None
+        sl = _chunk_kind(node.slice, names)
+        if kind == 'const':
+            return 'const' if sl == 'const' else None
+        ## df[mask], s[mask]
+        if sl == 'row':
+            return 'row'
+        ## df['col'], df[['a', 'b']] (on a Series, s[0] is an index lookup)
+        if sl == 'const' and _chunk_frame(node.value, names):
+            return 'row'
+        return None
+    if isinstance(node, ast.Call):
+        args = _chunk_join(_chunk_kind(a, names) for a in node.args + [k.value for k in node.keywords])
+        if args is None:
+            return None
+        func = node.func
+        if isinstance(func, ast.Name):
+            if args == 'const' and names.get(func.id, 'const') == 'const':
+                return 'const'
+            return 'row' if func.id in _CHUNK_BUILTINS and func.id not in names else None
+        if not isinstance(func, ast.Attribute):
+            return None
+        receiver = _chunk_kind(func.value, names)
+        if receiver == 'const':
+            if args == 'const':
+                return 'const'
+            ## np.log(df.a), np.where(df.a > 0, 1, 0), pd.to_datetime(df.d)
+            if isinstance(func.value, ast.Name) and func.value.id in ('np', 'numpy', 'pd', 'pandas'):
+                if func.attr == 'where' and len(node.args) != 3:
+                    return None
+                if func.attr in _CHUNK_FUNCS or isinstance(getattr(np, func.attr, None), np.ufunc):
+                    return 'row'
+            return None
+        if receiver is None:
+            return None
+        ## fillna(method='ffill') reads the previous chunk
+        if any(k.arg in ('method', 'limit') for k in node.keywords):
+            return None
+        ## assign/where/mask pass the whole chunk to a lambda
+        if func.attr not in _CHUNK_CALLBACK and any(isinstance(a, ast.Lambda)
+                for a in node.args + [k.value for k in node.keywords]):
+            return None
+        ## query/eval strings are checked like formulas
+        if func.attr in ('query', 'eval'):
+            return 'row' if _chunk_frame(func.value, names) and _chunk_query(node, names) else None
+        if func.attr in _CHUNK_ROWWISE or isinstance(func.value, ast.Attribute) \
+                and func.value.attr in ('str', 'dt'):
+            return 'row'
+        ## df['col'].apply(f), df.col.apply(f), df.apply(f, axis=1)
+        ## (df[['a', 'b']].apply(f) is column-wise)
+        if func.attr == 'apply':
+            if isinstance(func.value, ast.Subscript) and isinstance(func.value.slice, ast.Constant) \
+                    and _chunk_frame(func.value.value, names) \
+                    or isinstance(func.value, ast.Attribute) and _chunk_kind(func.value, names) == 'row':
+                return 'row'
+            if any(k.arg == 'axis' and isinstance(k.value, ast.Constant) and k.value.value in (1, 'columns')
+                   for k in node.keywords):
+                return 'row'
+        return None
+    if isinstance(node, ast.Lambda):
+        ## the body must not look at other rows of df
+        used = {n.id for n in ast.walk(node.body) if isinstance(n, ast.Name)}
+        return None if used & set(names) else 'const'
+    if isinstance(node, ast.BinOp):
+        return _chunk_join([_chunk_kind(node.left, names), _chunk_kind(node.right, names)])
+    if isinstance(node, ast.UnaryOp):
+        return _chunk_kind(node.operand, names)
+    if isinstance(node, ast.BoolOp):
+        return _chunk_join(_chunk_kind(v, names) for v in node.values)
+    if isinstance(node, ast.Compare):
+        return _chunk_join(_chunk_kind(n, names) for n in [node.left] + node.comparators)
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return 'const' if _chunk_join(_chunk_kind(e, names) for e in node.elts) == 'const' else None
+    if isinstance(node, ast.Dict):
+        parts = [k for k in node.keys if k is not None] + node.values
+        return 'const' if _chunk_join(_chunk_kind(e, names) for e in parts) == 'const' else None
+    return None
+
+def _chunk_statement(stmt, names):
+    ## assignments of row-wise or constant values keep chunks independent.
+    ## updates names with the variables assigned from df
+    if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return True
+    if isinstance(stmt, ast.Assign):
+        targets, kind = stmt.targets, _chunk_kind(stmt.value, names)
+    elif isinstance(stmt, ast.AugAssign):
+        targets = [stmt.target]
+        kind = _chunk_join([_chunk_kind(stmt.target, names), _chunk_kind(stmt.value, names)])
+    else:
+        return False
+    if kind is None:
+        return False
+    for target in targets:
+        if isinstance(target, ast.Name):
+            if kind == 'row':
+                names[target.id] = 'row'
+            elif target.id != 'df':
+                names.pop(target.id, None)
+            else:
+                return False
+        elif isinstance(target, (ast.Subscript, ast.Attribute)):
+            ## df['z'] = ..., x['key'] = <const>
+            base = _chunk_kind(target.value, names)
+            if base is None or base == 'const' and kind == 'row':
+                return False
+            if isinstance(target, ast.Subscript) and _chunk_kind(target.slice, names) is None:
+                return False
+            ## s[0] = ... on a Series sets one label, not a column
+            if base == 'row' and not _chunk_frame(target.value, names) and not (
+                    isinstance(target, ast.Subscript) and _chunk_kind(target.slice, names) == 'row'):
+                return False
+        else:
+            return False
+    return True
+
+def _chunk_groupby(node, names):
+    ## df.groupby(key) and its column selection. keyword arguments such as
+    ## as_index=False change the index that partial results are merged on
+    if isinstance(node, ast.Subscript):
+        return _chunk_kind(node.slice, names) == 'const' and _chunk_groupby(node.value, names)
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+        and node.func.attr == 'groupby' and len(node.args) == 1 and not node.keywords \
+        and _chunk_kind(node.args[0], names) is not None \
+        and _chunk_kind(node.func.value, names) == 'row'
+
+def _chunk_aggfunc(node):
+    ## 'mean', np.mean, sum, ... -> 'mean', 'sum', ...
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return _CHUNK_AGGFUNCS.get(node.value)
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id in ('np', 'numpy'):
+        return _CHUNK_AGGFUNCS.get(node.attr)
+    if isinstance(node, ast.Name) and node.id in ('sum', 'min', 'max'):
+        return node.id
+    return None
+
+def _chunk_plan(expr, names):
+    ## returns ('row', code) or ('reduce', obj_code, how, args_code)
+    ## or None if the expression can not be evaluated chunk by chunk
+    node = expr.body
+    if _chunk_kind(node, names) == 'row':
+        return ('row', compile(expr, '<formula>', 'eval'))
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+        return None
+    method = node.func.attr
+    if method not in _CHUNK_REDUCERS:
+        return None
+    obj = node.func.value
+    if not (_chunk_kind(obj, names) == 'row' or _chunk_groupby(obj, names)):
+        return None
+    if method in ('agg', 'aggregate'):
+        if len(node.args) != 1 or node.keywords:
+            return None
+        spec = node.args[0]
+        if isinstance(spec, ast.Dict):
+            how = {}
+            for k, v in zip(spec.keys, spec.values):
+                if not (isinstance(k, ast.Constant) and _chunk_aggfunc(v)):
+                    return None
+                how[k.value] = _chunk_aggfunc(v)
+        else:
+            how = _chunk_aggfunc(spec)
+            if how is None:
+                return None
+        call = ast.Call(func=ast.Name(id='_chunk_args', ctx=ast.Load()), args=[], keywords=[])
+    else:
+        how = method
+        if how == 'describe' and 'groupby' in ast.dump(obj):
+            return None
+        if _chunk_join(_chunk_kind(a, names) for a in node.args + [k.value for k in node.keywords]) != 'const':
+            return None
+        call = ast.Call(func=ast.Name(id='_chunk_args', ctx=ast.Load()),
+                        args=node.args, keywords=node.keywords)
+    obj_code  = compile(ast.fix_missing_locations(ast.Expression(body=obj)), '<formula>', 'eval')
+    args_code = compile(ast.fix_missing_locations(ast.Expression(body=call)), '<formula>', 'eval')
+    return ('reduce', obj_code, how, args_code)
+
+def _chunk_partial(obj, how, a, k, state):
+    if how in ('count', 'size'):
+        return getattr(obj, how)()
+    if how == 'mean':
+        return (obj.sum(*a, **k), obj.count())
+    if how == 'describe':
+        ## keep only the columns that describe() uses
+        if isinstance(obj, pd.DataFrame):
+            if 'columns' not in state:
+                state['columns'] = obj.describe(*a, **k).columns
+            return obj[state['columns']]
+        return obj
+    return getattr(obj, how)(*a, **k)
+
+def _chunk_combine(parts, how, grouped):
+    if how == 'mean':
+        s = _chunk_combine([p[0] for p in parts], 'sum', grouped)
+        c = _chunk_combine([p[1] for p in parts], 'sum', grouped)
+        if isinstance(s, (pd.Series, pd.DataFrame)):
+            return (s / c).reindex_like(s)
+        return s / c
+    if how in ('count', 'size'):
+        how = 'sum'
+    if not any(isinstance(p, (pd.Series, pd.DataFrame)) for p in parts):
+        return getattr(pd.Series(parts), how)()
+    merged = pd.concat(parts)
+    levels = list(range(merged.index.nlevels))
+    return getattr(merged.groupby(level=levels, sort=grouped), how)()
+
+def _chunk_reduce(plan, parts):
+    obj_code, how, args_code = plan[1:]
+    grouped = parts['grouped']
+    if how == 'describe':
+        ## quantiles need all values: the used columns of every chunk are kept
+        a, k = parts['args']
+        return pd.concat(parts['values']).describe(*a, **k)
+    if isinstance(how, dict):
+        ans = {col: _chunk_combine([p[col] for p in parts['values']], h, grouped)
+               for col, h in how.items()}
+        return pd.DataFrame(ans) if grouped else pd.Series(ans)
+    return _chunk_combine(parts['values'], how, grouped)
+
+def print_chunk(ans, first):
+    if isinstance(ans, pd.DataFrame):
+        print(ans.to_string(header=first))
+    elif isinstance(ans, pd.Series):
+        print(ans.to_string())
+    else:
+        print(ans)
+
+def write_chunk(df, first):
+    if args.debug:
+        print_chunk(df, first)
+    elif args.csv or args.tsv or args.ssv:
+        write_table(df, header=first)
+
+def run_chunks(readfile):
+    global df
+    try:
+        pieces = parse_formula(args.formula)
+    except SyntaxError as e:
+        raise_error("Formula syntax error: {0}", e)
+    plans = []
+    names = {'df': 'row'}
+    for is_exec, node in pieces:
+        if is_exec:
+            ## statements must keep df and variables row-wise
+            if all(_chunk_statement(stmt, names) for stmt in node.body):
+                plans.append(compile(node, '<formula>', 'exec'))
+            else:
+                plans.append(None)
+        else:
+            plans.append(_chunk_plan(node, names))
+    chunkable = all(plan is not None for plan in plans)
+    dump = args.debug or args.csv or args.tsv or args.ssv
+    reader = pd.read_csv(readfile, chunksize=args.chunksize, **get_read_options())
+    if not dump and not chunkable:
+        ## fallback: formula is not chunkable. read whole input
+        print("Warning: formula can not be evaluated chunk by chunk. read whole input.", file=sys.stderr)
+        df = pd.concat(reader)
+        if args.normalize:
+            df = normalize_dataframe(df)
+        run_formula()
+        return
+    globals()['_chunk_args'] = lambda *a, **k: (a, k)
+    partials = [{'values': [], 'grouped': False, 'state': {}, 'printed': False} for plan in plans]
+    first = True
+    with reader:
+        for chunk in reader:
+            df = chunk
+            if args.normalize:
+                df = normalize_dataframe(df)
+            if dump:
+                write_chunk(df, first)
+                first = False
+                continue
+            for (is_exec, node), plan, parts in zip(pieces, plans, partials):
+                if is_exec:
+                    exec(plan, globals())
+                elif plan[0] == 'row':
+                    ans = eval(plan[1], globals())
+                    if args.quiet:
+                        pass
+                    elif isinstance(ans, (pd.Series, pd.DataFrame)) and ans.empty:
+                        ## skip empty chunk results
+                        parts['values'] = [ans]
+                    else:
+                        print_chunk(ans, not parts['printed'])
+                        parts['printed'] = True
+                else:
+                    obj_code, how, args_code = plan[1:]
+                    obj = eval(obj_code, globals())
+                    a, k = eval(args_code, globals())
+                    parts['grouped'] = isinstance(obj, pd.core.groupby.GroupBy)
+                    parts['args'] = (a, k)
+                    if isinstance(how, dict):
+                        parts['values'].append({col: _chunk_partial(obj[col], h, a, k, parts['state'])
+                                                for col, h in how.items()})
+                    else:
+                        parts['values'].append(_chunk_partial(obj, how, a, k, parts['state']))
+            first = False
+    if dump:
+        return
+    for (is_exec, node), plan, parts in zip(pieces, plans, partials):
+        if is_exec or not parts['values']:
+            pass
+        elif plan[0] == 'row':
+            ## all chunk results were empty
+            if not parts['printed']:
+                print(parts['values'][0])
+        else:
+            ans = _chunk_reduce(plan, parts)
+            if not args.quiet:
+                print(ans)
+
+## multiprocess parallel evaluation (--jobs N)
+##   row-wise formulas are split by row ranges,
+##   df.groupby(key).<func>() formulas are split by group key.
+##   worker processes are forked, so they inherit df and variables.
+_PARALLEL_GROUPWISE = ('agg', 'aggregate', 'apply', 'transform', 'filter',
+                       'sum', 'count', 'size', 'min', 'max', 'mean', 'median', 'std', 'var', 'sem',
+                       'prod', 'quantile', 'describe', 'first', 'last', 'nth', 'head', 'tail',
+                       'nunique', 'value_counts', 'idxmin', 'idxmax', 'any', 'all', 'ohlc', 'rank',
+                       'cumsum', 'cumprod', 'cummin', 'cummax', 'cumcount')
+## results indexed by the rows of df (others are indexed by the group key)
+_PARALLEL_TRANSFORM = ('transform', 'filter', 'nth', 'head', 'tail', 'rank',
+                       'cumsum', 'cumprod', 'cummin', 'cummax', 'cumcount')
+_parallel_code  = None
+_parallel_parts = None
+
+def _groupby_state(node, names):
+    ## returns (key, method) or None. method is None until a groupwise
+    ## method is called on the groupby object
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        if node.func.attr == 'groupby':
+            if len(node.args) != 1 or node.keywords or _chunk_kind(node.func.value, names) != 'row':
+                return None
+            try:
+                key = ast.literal_eval(node.args[0])
+            except ValueError:
+                return None
+            if isinstance(key, str):
+                return ([key], None)
+            if isinstance(key, (list, tuple)) and all(isinstance(k, str) for k in key):
+                return (list(key), None)
+            return None
+        inner = _groupby_state(node.func.value, names)
+        if inner and not inner[1] and node.func.attr in _PARALLEL_GROUPWISE:
+            ## arguments must not look at the other groups of df
+            if _chunk_join(_chunk_kind(a, names) for a in node.args + [k.value for k in node.keywords]) != 'const':
+                return None
+            return (inner[0], node.func.attr)
+        return None
+    ## column selection on groupby object
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, (ast.Constant, ast.List)):
+        inner = _groupby_state(node.value, names)
+        if inner and not inner[1]:
+            return inner
+    if isinstance(node, ast.Attribute):
+        inner = _groupby_state(node.value, names)
+        if inner and not inner[1]:
+            return inner
+    return None
+
+def _parallel_names(stmt, names):
+    ## workers slice only df: variables assigned from df keep the whole
+    ## input, so they can not be used in a parallel formula
+    stored = [n.id for n in ast.walk(stmt) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)]
+    tainted = any(isinstance(n, ast.Name) and n.id in names for n in ast.walk(stmt))
+    for name in stored:
+        if name == 'df':
+            continue
+        if tainted:
+            names[name] = None
+        else:
+            names.pop(name, None)
+
+def _parallel_plan(node, names):
+    ## returns ('row', None), ('group', key, method) or None (serial)
+    if not any(isinstance(n, ast.Call) for n in ast.walk(node)):
+        return None
+    if _chunk_kind(node, names) == 'row':
+        return ('row', None)
+    state = _groupby_state(node, names)
+    if state and state[1]:
+        return ('group', state[0], state[1])
+    return None
+
+def _parallel_worker(part):
+    global df
+    if isinstance(part, tuple):
+        df = df.iloc[part[0]:part[1]]
+    else:
+        df = df[_parallel_parts == part]
+    return eval(_parallel_code, globals())
+
+def parallel_eval(node, plan):
+    import concurrent.futures, multiprocessing
+    global _parallel_code, _parallel_parts
+    _parallel_code = compile(ast.fix_missing_locations(ast.Expression(body=node)), '<formula>', 'eval')
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    if plan[0] == 'group' and plan[2] in _PARALLEL_TRANSFORM and not df.index.is_unique:
+        ## rows can not be put back in order by index labels
+        return eval(_parallel_code, globals())
+    if plan[0] == 'row':
+        bounds = np.linspace(0, len(df), jobs + 1).astype(int)
+        parts = [(int(bounds[i]), int(bounds[i + 1])) for i in range(jobs)]
+    else:
+        _parallel_parts = (df.groupby(plan[1], sort=False).ngroup() % jobs).to_numpy()
+        parts = list(range(jobs))
+    ctx = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+        results = list(pool.map(_parallel_worker, parts))
+    if all(isinstance(r, np.ndarray) for r in results):
+        ## np.where(df.a > 0, 1, 0), ...
+        return np.concatenate(results)
+    nonempty = [r for r in results if not r.empty]
+    ans = pd.concat(nonempty if nonempty else results[:1])
+    if plan[0] == 'group':
+        if plan[2] in _PARALLEL_TRANSFORM:
+            ## rows in the order of df
+            ans = ans.reindex(df.index[df.index.isin(ans.index)])
+        else:
+            ## groups in the order of the key, rows within a group as returned
+            ans = ans.sort_index(level=list(range(len(plan[1]))), sort_remaining=False, kind='stable')
+    return ans
+
+def run_parallel():
+    import multiprocessing
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        ## fork is not available (windows)
+        run_formula()
+        return
+    try:
+        pieces = parse_formula(args.formula)
+    except SyntaxError as e:
+        raise_error("Formula syntax error: {0}", e)
+    names = {'df': 'row'}
+    for is_exec, node in pieces:
+        if is_exec:
+            for stmt in node.body:
+                _parallel_names(stmt, names)
+                ## df['col'] = <row-wise formula>
+                if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 \
+                        and _parallel_plan(stmt.value, names):
+                    globals()['_parallel_value'] = parallel_eval(stmt.value, _parallel_plan(stmt.value, names))
+                    stmt = ast.Assign(targets=stmt.targets, value=ast.Name(id='_parallel_value', ctx=ast.Load()))
+                    ast.copy_location(stmt, node.body[0])
+                module = ast.fix_missing_locations(ast.Module(body=[stmt], type_ignores=[]))
+                exec(compile(module, '<formula>', 'exec'), globals())
+        else:
+            plan = _parallel_plan(node.body, names)
+            if plan:
+                ans = parallel_eval(node.body, plan)
+            else:
+                ans = eval(compile(node, '<formula>', 'eval'), globals())
+            if args.quiet:
+                pass
+            else:
+                print(ans)
+
+## warm worker daemon (--serve) and thin client (--connect)
+##   frame: channel(1 byte: o=stdout, e=stderr, x=exit code) + length(4 bytes) + payload
+def get_socket_path(path=None):
+    import tempfile
+    if path:
+        return path
+    ## per-user directory (mode 0700) in $TMPDIR
+    return os.path.join(tempfile.gettempdir(), 'pycalc-{}'.format(os.getuid()), 'pycalc.sock')
+
+def check_socket_owner(path):
+    ## the socket must be ours: do not send stdin to another user's server
+    import stat
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise_error("Not a socket: {0}", path)
+    if st.st_uid != os.getuid():
+        raise_error("Socket is owned by another user: {0}", path)
+
+class _ChannelWriter(io.RawIOBase):
+    def __init__(self, conn, channel):
+        self.conn = conn
+        self.channel = channel
+    def writable(self):
+        return True
+    def write(self, b):
+        b = bytes(b)
+        self.conn.sendall(self.channel + struct.pack('>I', len(b)) + b)
+        return len(b)
+
+def serve_request(conn):
+    import traceback
+    rfile = conn.makefile('rb')
+    request = json.loads(rfile.readline().decode('utf-8'))
+    sys.stdin  = io.TextIOWrapper(rfile, encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(_ChannelWriter(conn, b'o'), 65536), encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(_ChannelWriter(conn, b'e'), encoding='utf-8', write_through=True)
+    code = 0
+    try:
+        os.chdir(request['cwd'])
+        main(get_args(request['argv']))
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(b'x' + struct.pack('>I', 4) + struct.pack('>i', code))
+
+def run_server(path):
+    import signal, socket, socketserver
+    class _RequestHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            serve_request(self.request)
+    class _ForkingUnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+    if not hasattr(socket, 'AF_UNIX') or not hasattr(os, 'fork'):
+        raise_error("--serve is not supported on this platform")
+    if not args.socket:
+        ## default path: create the per-user directory with mode 0700
+        sockdir = os.path.dirname(path)
+        try:
+            os.mkdir(sockdir, 0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat(sockdir)
+        if not os.path.isdir(sockdir) or os.path.islink(sockdir) \
+                or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise_error("Socket directory must be owned by you with mode 0700: {0}", sockdir)
+    if os.path.lexists(path):
+        check_socket_owner(path)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(path)
+            raise_error("pycalc server is already running: {0}", path)
+        except OSError:
+            ## remove stale socket file (only sockets, see check_socket_owner)
+            os.remove(path)
+    ## remove socket file on kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    ## create the socket with mode 0600
+    umask = os.umask(0o177)
+    try:
+        server = _ForkingUnixServer(path, _RequestHandler)
+    finally:
+        os.umask(umask)
+    with server:
+        print("pycalc server listening on " + path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+def run_client(path, argv):
+    import socket, threading
+    check_socket_owner(path)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        raise_error("Could not connect to pycalc server: {0}", path)
+    header = json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n'
+    conn.sendall(header.encode('utf-8'))
+    def send_stdin():
+        try:
+            if not args.inputfile:
+                while True:
+                    block = sys.stdin.buffer.read1(65536)
+                    if not block:
+                        break
+                    conn.sendall(block)
+            conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+    threading.Thread(target=send_stdin, daemon=True).start()
+    rfile = conn.makefile('rb')
+    while True:
+        frame = rfile.read(5)
+        if len(frame) < 5:
+            raise_error("Connection to pycalc server closed")
+        channel = frame[:1]
+        payload = rfile.read(struct.unpack('>I', frame[1:])[0])
+        if channel == b'o':
+            sys.stdout.buffer.write(payload)
+        elif channel == b'e':
+            sys.stdout.flush()
+            sys.stderr.buffer.write(payload)
+            sys.stderr.flush()
+        else:
+            sys.stdout.flush()
+            return struct.unpack('>i', payload)[0]
+
+def setup_matplotlib(plt):
+    plt.rcParams['font.family'] = 'sans-serif'
+    ## on windows
+    if os.name == 'nt':
+        plt.rcParams['font.sans-serif'] = ['IPAexGothic', 'BIZ UDGothic', 'MS Gothic', 'Yu Gothic', 'Noto Sans CJK JP']
+    plt.rcParams['pdf.fonttype'] = 42
+    plt.rcParams['ps.fonttype'] = 42
+    ## set figure size
+    if args.size:
+        if len(args.size) == 1:
+            w_inch = args.size[0]
+            h_inch = args.size[0]
+        else:
+            w_inch = args.size[0]
+            h_inch = args.size[1]
+        plt.rcParams['figure.figsize'] = (w_inch, h_inch)
+        debStr = "plt.rcParams['figure.figsize'] = ({}, {})".format(w_inch, h_inch)
+        if args.debug: print(debStr)
+
+def uses_pandas_plot(formula):
+    ## df.plot(), df.hist(), df.boxplot() (not column names like plot_id)
+    try:
+        tree = ast.parse(str(formula))
+    except SyntaxError:
+        return False
+    return any(isinstance(node, ast.Attribute) and node.attr in ('plot', 'hist', 'boxplot')
+               for node in ast.walk(tree))
+
+def import_module_lazy(statement):
+    ## "import a.b", "import a as b": imported on first attribute access
+    ## "from a import b": imported now
+    for node in ast.parse(statement).body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                top = alias.name.split('.')[0]
+                if importlib.util.find_spec(top) is None:
+                    raise ImportError(alias.name)
+                if alias.asname:
+                    globals()[alias.asname] = LazyModule(alias.name)
+                else:
+                    globals()[top] = LazyModule(top, imports=[alias.name] if alias.name != top else [])
+        else:
+            t = time.perf_counter()
+            exec(compile(ast.Module(body=[node], type_ignores=[]), '<module>', 'exec'), globals())
+            _import_times.append((ast.unparse(node), time.perf_counter() - t))
+
+def print_startup_profile():
+    print("startup profile:", file=sys.stderr)
+    for name, sec in _import_times:
+        print("  {0:<30} {1:8.3f} s".format(name, sec), file=sys.stderr)
+    if _startup_done:
+        print("  {0:<30} {1:8.3f} s".format('(startup total)', _startup_done - _t0), file=sys.stderr)
+    print("  {0:<30} {1:8.3f} s".format('(total)', time.perf_counter() - _t0), file=sys.stderr)
+
+_startup_done = None
+
+def main(cmdargs):
+    global args
+    args = cmdargs
+    try:
+        run_main()
+    finally:
+        if args.profile_startup:
+            print_startup_profile()
+
+def run_main():
+    global df, plt, rcParams, _startup_done
+
+    ## clear cache
+    if args.clear_cache:
+        clear_cache()
+        if args.formula is None:
+            sys.exit(0)
+
+    # import matplotlib lazily
+    plt      = LazyModule('matplotlib.pyplot', setup=setup_matplotlib)
+    rcParams = LazyModule('matplotlib.pyplot', attr='rcParams', setup=setup_matplotlib)
+    ## df.plot() imports matplotlib by pandas, so set up in advance
+    if args.formula and uses_pandas_plot(args.formula):
+        plt._load()
 
     # import modules
     if args.module:
@@ -237,11 +1552,11 @@ if __name__ == '__main__':
                 #mod = re.search(r'\'[^\']+\'', str(mod)).strip("'")
                 if re.search(r'^import|^from', mod):
                     ## as is module str
-                    exec(mod, globals())
+                    import_module_lazy(mod)
                 else:
                     ## if module name only
-                    exec('import ' + mod, globals())
-            except NameError:
+                    import_module_lazy('import ' + mod)
+            except (NameError, ImportError, SyntaxError):
                 raise_error("Module Name Error")
 
     '''
@@ -253,29 +1568,11 @@ if __name__ == '__main__':
             #locals()[token[0]] = token[1]
             #valStr = str(token[0]).strip() + "=" + str(token[1]).strip()
             valStr = str(eq).strip()
-            exec(valStr)
+            exec(valStr, globals())
 
     ## read file
     readfile = open_file()
 
-    # read dataframe
-    if args.noheader:
-        if args.index:
-            df = pd.read_csv(readfile, sep=args.delimiter, index_col=0, header=None)
-        elif args.datetime:
-            df = pd.read_csv(readfile, sep=args.delimiter, index_col=0, header=None, parse_dates=True)
-        else:
-            df = pd.read_csv(readfile, sep=args.delimiter, header=None)
-    else:
-        if args.index:
-            df = pd.read_csv(readfile, sep=args.delimiter, index_col=0)
-        elif args.datetime:
-            df = pd.read_csv(readfile, sep=args.delimiter, index_col=0, parse_dates=True)
-        else:
-            df = pd.read_csv(readfile, sep=args.delimiter)
-    if args.normalize:
-        df = df.applymap(lambda x: unicodedata.normalize('NFKC',x))
-
     ## do not fold output
     if args.nowrap:
         pd.set_option('display.expand_frame_repr', False)
@@ -283,29 +1580,65 @@ if __name__ == '__main__':
     pd.set_option('display.max_rows', args.max_rows)
     pd.option_context('display.max_colwidth', args.max_colwidth)
 
+    _startup_done = time.perf_counter()
+
+    ## chunked streaming evaluation
+    if args.chunksize and args.batch:
+        raise_error("--batch can not be used with --chunksize")
+    if args.chunksize:
+        run_chunks(readfile)
+        sys.exit(0)
+
+    ## memory usage with default read options
+    if args.memory:
+        if not isinstance(readfile, str):
+            readfile = io.StringIO(readfile.read())
+        print_memory_usage('default', pd.read_csv(readfile, **get_read_options(lean=False)))
+        if not isinstance(readfile, str):
+            readfile.seek(0)
+
+    # read dataframe
+    df = read_dataframe(readfile, get_read_options())
+    if args.normalize:
+        df = normalize_dataframe(df)
+    if args.memory:
+        print_memory_usage('lean', df)
+
+    ## batch mode
+    if args.batch:
+        run_batch()
+        sys.exit(0)
+
     ## execute formula and print answer
     #print(args.formula)
     if args.debug:
         print(df)
-    elif args.csv:
-        df.to_csv(sys.stdout, index=True, sep=",")
-    elif args.tsv:
-        df.to_csv(sys.stdout, index=True, sep=r"\t")
-    elif args.ssv:
-        df.to_csv(sys.stdout, index=True, sep=" ")
+    elif args.csv or args.tsv or args.ssv:
+        if args.bench_write:
+            bench_write(df)
+        write_table(df)
+    elif args.jobs != 1:
+        run_parallel()
     else:
-        fmls = str(args.formula).split(";")
-        for fml in fmls:
-            fml = str(fml).strip()
-            # if formula(tml) contains "=", run exec, otherwise run eval
-            if re.search(r'^([^\(]+)=', fml):
-                exec(fml)
-            else:
-                ans = eval(fml)
-                if args.quiet:
-                    pass
-                else:
-                    print(ans)
+        run_formula()
 
     sys.exit(0)
 
+if __name__ == '__main__':
+
+    # get args
+    args = get_args()
+
+    ## thin client: numpy and pandas are not imported
+    if args.connect:
+        sys.exit(run_client(get_socket_path(args.socket), sys.argv[1:]))
+
+    np = timed_import('numpy')
+    pd = timed_import('pandas')
+
+    ## warm worker daemon: fork a fresh interpreter state per request
+    if args.serve:
+        run_server(get_socket_path(args.socket))
+        sys.exit(0)
+
+    main(args)
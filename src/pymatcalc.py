@@ -8,7 +8,14 @@
 import io, sys, os
 import re
 import argparse
-import numpy as np
+import ast
+import shutil
+import struct
+import tempfile
+import zipfile
+import time
+import warnings
+## numpy is imported in __main__ (after --threads sets BLAS threads)
 
 _version = "Wed Mar 8 06:53:17 JST 2023"
 _code    = "MyCommands(LINUX+WINDOWS/PYTHON3/UTF-8)"
@@ -26,7 +33,7 @@ elif os.name == 'posix':
 def raise_error(msg, *arg):
     scriptfile = os.path.basename(__file__)
     errorheader = "Error[" + scriptfile + "]:"
-    print(errorheader, msg.format(arg), file=sys.stderr)
+    print(errorheader, msg.format(*arg), file=sys.stderr)
     sys.exit(1)
 
 def get_args():
@@ -53,6 +60,13 @@ def get_args():
         good: pymatcalc 'C=np.eye(1, dtype=int)'
         ng:   pymatcalc 'np.eye(1, dtype=int)'
 
+        Multiple formulas separated by ";" (or lines of -F <file>)
+        are evaluated in order against the same matrices, and
+        each new label is printed once.
+
+        pymatcalc 'C=A@B; D=A@C'
+        pymatcalc -F formulas.txt
+
     Input format:
         label val val ...
         label val val ...
@@ -64,6 +78,59 @@ def get_args():
             B 4 3
             B 2 1
 
+    Consecutive lines with the same label are read as one matrix.
+    Each block is converted to np.array in bulk and stored in a dict.
+    --parse-stats prints parse throughput (MB/s) to stderr.
+    -f '%.6g' formats the output elements like np.savetxt.
+
+    Streaming:
+        An elementwise formula of one label (e.g. 'C=A*2+1', 'np.log(A)',
+        'C=A[:,1:3]') is evaluated on blocks of rows while reading,
+        so tall matrices run in constant memory (--no-stream to disable).
+
+    BLAS threads:
+        --threads N limits the threads of BLAS/LAPACK used by @, inv,
+        solve, eig, ... (avoid oversubscription when many pymatcalc
+        run in parallel pipelines). --blas-info prints the backend.
+
+        pymatcalc 'C=np.linalg.inv(A)' --threads 2 --blas-info
+
+    Binary pipeline:
+        --binary-out writes all matrices as labelled .npy frames and
+        --binary-in reads them, so chained stages exchange arrays without
+        text conversion. The last stage without --binary-out prints text.
+
+        pymatcalc 'C=A@B' --binary-out | pymatcalc 'D=A@C' --binary-in
+
+    Memory-mapped input:
+        -i A.npy -i B.npy binds arrays to labels by file name stem and
+        -i mats.npz by member names (add -i - to also read stdin). Arrays are opened with mmap, so
+        A[:1000] or A.T@B reads only the pages needed (compressed .npz
+        members are read into memory). They are not echoed.
+        --out C.npy saves the last result, --out out.npz all results.
+
+        pymatcalc -i A.npy -i B.npy 'C=A.T@B' --out C.npy
+
+    Batched groups:
+        -g reads lines of "group label val val ...". The matrices of each
+        label are stacked over groups (3-D array). Formulas made of @,
+        np.linalg.solve/inv/det/eig and elementwise operations are
+        evaluated once on the stack. Other formulas (.T, reductions,
+        indexing, ...) are evaluated group by group.
+        Results are printed with the group key.
+
+        pymatcalc -g 'X=np.linalg.solve(L, R)'
+
+    Sparse matrix:
+        --sparse reads lines of "label row col value" (0-based index)
+        as scipy.sparse csr matrices. The shape is max index + 1.
+        sp (scipy.sparse), spla (scipy.sparse.linalg) and spsolve can be
+        used in formulas. Sparse results are printed as nonzeros in the
+        same format.
+
+        pymatcalc --sparse 'C=A@A.T'
+        pymatcalc --sparse 'x=spsolve(A, np.ones(A.shape[0]))'
+
     Functions:
         - Scalar product: pymatcalc 'C=A*B'
         - Hadamard product (element-wise multiplication): pymatcalc 'C=np.multiply(A, B)'
@@ -201,108 +268,777 @@ def get_args():
                     formatter_class=argparse.RawDescriptionHelpFormatter)
     #parser = argparse.ArgumentParser(description='calc matrix using numpy')
     #parser.print_help()
-    parser.add_argument("formula", help="numpy formula", type=str)
-    parser.add_argument("-i", "--inputfile", help="input file name", type=str)
+    parser.add_argument("formula", help="numpy formula(s) separated by ';'", type=str, nargs='?')
+    parser.add_argument("-F", "--formula-file", help="read formulas from file (one per line)", type=str)
+    parser.add_argument("-i", "--inputfile", help="input file name (.npy/.npz: memory-mapped, repeatable)", type=str, action="append")
     parser.add_argument("-q", "--quiet", help="print as it is", action="store_true")
     parser.add_argument("-t", "--dtype", help="array data type", default='float', type=str)
     parser.add_argument("-d", "--delimiter", help="line separator(delimiter)", default=r' ',
         choices=[r" ", r",", r"\t"])
+    parser.add_argument("-f", "--fmt", help="output format of elements (e.g. %%.6g)", default=None, type=str)
+    parser.add_argument("-g", "--group", help="first field is group key: evaluate stacked matrices of all groups at once", action="store_true")
+    parser.add_argument("--sparse", help="read 'label row col value' lines as scipy.sparse csr matrix", action="store_true")
+    parser.add_argument("--binary-in", help="read binary matrix stream written by --binary-out", action="store_true")
+    parser.add_argument("--binary-out", help="write matrices as binary stream (label + npy)", action="store_true")
+    parser.add_argument("--out", help="write results to .npy (last result) or .npz (all results)", type=str)
+    parser.add_argument("--no-stream", help="do not evaluate row-wise formula while reading", action="store_true")
+    parser.add_argument("--threads", help="number of BLAS threads (set before numpy import)", default=None, type=int)
+    parser.add_argument("--blas-info", help="print BLAS backend and threads to stderr", action="store_true")
+    parser.add_argument("--parse-stats", help="print parse throughput to stderr", action="store_true")
     parser.add_argument("-V", "--version", help="version", action="version", version=_version)
     args = parser.parse_args()
     return(args)
 
+## output matrix
+##   rows are formatted in bulk and written in blocks to the binary stdout.
+##   default: str() of each element, same as before
+##   --fmt: one printf-style row format per row like np.savetxt
+_OUT_CELLS = 1 << 16
+
+def format_rows(key, block, delim, fmt):
+    if fmt:
+        rowfmt = key.replace('%', '%%') + delim + delim.join([fmt] * block.shape[1])
+        return [rowfmt % tuple(r) for r in block.tolist()]
+    prefix = key + delim
+    return [prefix + delim.join(map(str, r)) for r in block]
+
+def write_rows(out, key, mat):
+    delim = get_delimiter()
+    step = max(1, _OUT_CELLS // max(1, mat.shape[1]))
+    for i in range(0, mat.shape[0], step):
+        try:
+            lines = format_rows(key, mat[i:i + step], delim, args.fmt)
+        except (TypeError, ValueError) as e:
+            raise_error("Could not format matrix with --fmt {0}: {1}", args.fmt, e)
+        out.write((os.linesep.join(lines) + os.linesep).encode('utf-8'))
+
 def print_matrix(key, mat):
-    if mat.ndim == 2:
-        matlist = []
-        for i in range(mat.shape[0]):
-            matlist.append(key)
-            for j in range(mat.shape[1]):
-                matlist.append(mat[i][j])
-            ## print liststr
-            mapped_list = map(str, matlist)
-            liststr = args.delimiter.join(mapped_list)
-            print(liststr)
-            matlist = []
+    mat = np.asarray(mat)
     if mat.ndim == 1:
-        matlist = []
-        matlist.append(key)
-        for i in range(mat.shape[0]):
-            matlist.append(mat[i])
-        ## print liststr
-        mapped_list = map(str, matlist)
-        liststr = args.delimiter.join(mapped_list)
-        print(liststr)
+        mat = mat.reshape(1, -1)
+    if mat.ndim != 2:
+        return
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    write_rows(out, key, mat)
+    out.flush()
 
-def open_file(mode = 'r'):
-    if args.inputfile:
-        filename = re.sub(r'\\', '/', args.inputfile)
+def print_sparse(key, mat):
+    ## nonzeros as "label row col value" in row-major order
+    csr = mat.tocsr()
+    if not csr.has_sorted_indices:
+        csr = csr.sorted_indices()
+    coo = csr.tocoo()
+    delim = get_delimiter()
+    prefix = key + delim
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    for i in range(0, coo.nnz, _OUT_CELLS):
+        rows = coo.row[i:i + _OUT_CELLS].tolist()
+        cols = coo.col[i:i + _OUT_CELLS].tolist()
+        vals = coo.data[i:i + _OUT_CELLS]
         try:
-            readfile = open(filename, mode, encoding="utf-8")
-        except:
-            raise_error("Could not open file: %s", filename)
+            vals = [args.fmt % v for v in vals.tolist()] if args.fmt else map(str, vals)
+        except (TypeError, ValueError) as e:
+            raise_error("Could not format matrix with --fmt {0}: {1}", args.fmt, e)
+        lines = [prefix + str(r) + delim + str(c) + delim + v for r, c, v in zip(rows, cols, vals)]
+        out.write((os.linesep.join(lines) + os.linesep).encode('utf-8'))
+    ## keep the shape with an explicit zero at the last corner
+    nrows, ncols = coo.shape
+    if nrows and ncols and not (coo.nnz and coo.row[-1] == nrows - 1 and coo.col[-1] == ncols - 1):
+        out.write((prefix + str(nrows - 1) + delim + str(ncols - 1) + delim + '0' + os.linesep).encode('utf-8'))
+    out.flush()
+
+## BLAS threads (--threads N)
+##   environment variables must be set before numpy is imported.
+##   threadpoolctl (if installed) also limits already loaded libraries
+_THREAD_ENVS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                'VECLIB_MAXIMUM_THREADS', 'BLIS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+def set_blas_threads(n):
+    for name in _THREAD_ENVS:
+        os.environ[name] = str(n)
+
+def import_threadpoolctl():
+    try:
+        import threadpoolctl
+    except ImportError:
+        return None
+    return threadpoolctl
+
+def limit_blas_threads(n):
+    threadpoolctl = import_threadpoolctl()
+    if threadpoolctl:
+        threadpoolctl.threadpool_limits(limits=n)
+
+def print_blas_info():
+    threadpoolctl = import_threadpoolctl()
+    libs = threadpoolctl.threadpool_info() if threadpoolctl else []
+    for lib in libs:
+        print("blas: {0} {1} ({2}) threads={3} {4}".format(lib.get('internal_api'), lib.get('version'),
+            lib.get('threading_layer', lib.get('user_api')), lib.get('num_threads'), lib.get('filepath')),
+            file=sys.stderr)
+    if not libs:
+        try:
+            blas = np.show_config(mode='dicts')['Build Dependencies']['blas']
+            print("blas: {0} {1} (numpy build info, install threadpoolctl for runtime threads)".format(
+                blas.get('name'), blas.get('version')), file=sys.stderr)
+        except (TypeError, KeyError):
+            print("blas: unknown (install threadpoolctl for runtime info)", file=sys.stderr)
+    envs = ["{0}={1}".format(k, os.environ[k]) for k in _THREAD_ENVS if k in os.environ]
+    print("threads: {0} (cpu count: {1})".format(", ".join(envs) or "library default", os.cpu_count()),
+        file=sys.stderr)
+
+def get_delimiter():
+    if args.delimiter == r"\t":
+        return "\t"
+    return args.delimiter
+
+def get_dtype():
+    ## 'float', 'int', 'np.float32', ...
+    name = re.sub(r'^(np|numpy)\.', '', args.dtype)
+    try:
+        return np.dtype(name)
+    except TypeError:
+        raise_error("Unknown dtype: {0}", args.dtype)
+
+## parse labelled matrix blocks
+##   rows of a label run are buffered as raw strings and converted in bulk
+##   into a preallocated array that grows by doubling
+_BLOCK_CHARS = 1 << 22
+
+def parse_rows(key, rows, delim, dtype):
+    ncols = rows[0].count(delim) + 1 if rows[0] else 0
+    if dtype.kind in 'biuf' and ncols > 0 \
+            and all(r.count(delim) == ncols - 1 for r in rows):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', DeprecationWarning)
+                data = np.fromstring(delim.join(rows), dtype=dtype, sep=delim)
+            if data.size == len(rows) * ncols:
+                return data.reshape(len(rows), ncols)
+        except (DeprecationWarning, ValueError):
+            pass
+    ## fallback: complex, str, empty fields, ragged rows, ...
+    try:
+        data = np.array([r.split(delim) if r else [] for r in rows], dtype=dtype)
+    except ValueError as e:
+        raise_error("Could not parse matrix {0}: {1}", key, e)
+    if data.ndim != 2:
+        raise_error("Could not parse matrix {0}: rows have different lengths", key)
+    return data
+
+def append_rows(block, data):
+    mat, n = block['mat'], block['n']
+    if mat is None:
+        mat = data
+    elif mat.shape[1] != data.shape[1]:
+        raise_error("Could not parse matrix {0}: rows have different lengths", block['key'])
     else:
-        readfile = sys.stdin
-    return readfile
+        if n + len(data) > len(mat):
+            grown = np.empty((max(2 * len(mat), n + len(data)), mat.shape[1]), dtype=mat.dtype)
+            grown[:n] = mat[:n]
+            mat = grown
+        mat[n:n + len(data)] = data
+    block['mat'], block['n'] = mat, n + len(data)
 
-if __name__ == '__main__':
-    # get args
-    args = get_args()
-    tmpformula = args.formula.replace(' ','')
+def close_block(block, matrices):
+    mat, n = block['mat'], block['n']
+    if n < len(mat):
+        mat.resize((n, mat.shape[1]), refcheck=False)
+    ## a later run of the same label replaces the former matrix
+    matrices[block['key']] = mat
+
+def flush_rows(block, rows, delim, dtype, stream):
+    if stream is None:
+        append_rows(block, parse_rows(block['key'], rows, delim, dtype))
+    elif block['key'] == stream['key']:
+        stream_rows(stream, block, parse_rows(block['key'], rows, delim, dtype))
+
+def read_matrices(readfile, echo=True, stream=None):
+    ## stream: rows of stream['key'] are evaluated block by block
+    ##         and no matrix is kept in memory
+    delim = get_delimiter()
+    dtype = get_dtype()
+    write = sys.stdout.write
+    matrices = {}
+    block = None
+    rows = []
+    chars = 0
+    nbytes = 0
+    for line in readfile:
+        nbytes += len(line)
+        line = line.rstrip('\r\n')
+        if echo:
+            write(line + '\n')
+        key, _, values = line.partition(delim)
+        if args.group:
+            label, _, values = values.partition(delim)
+            key = (key, label)
+        if block is None or key != block['key']:
+            if block is not None:
+                flush_rows(block, rows, delim, dtype, stream)
+                if stream is None:
+                    close_block(block, matrices)
+            block = {'key': key, 'mat': None, 'n': 0}
+            rows = []
+            chars = 0
+        if stream is not None and key != stream['key']:
+            continue
+        rows.append(values)
+        chars += len(values)
+        if chars > _BLOCK_CHARS:
+            flush_rows(block, rows, delim, dtype, stream)
+            rows = []
+            chars = 0
+    if block is not None:
+        if rows:
+            flush_rows(block, rows, delim, dtype, stream)
+        if stream is None:
+            close_block(block, matrices)
+    return matrices, nbytes
+
+## streaming row-wise evaluation
+##   an elementwise formula of one label (e.g. C=A*2+1, np.log(A),
+##   A[:,1:3]) is evaluated on each row block while reading.
+##   result rows are spooled to a temporary file and printed after
+##   the echoed input, so the output is the same as before
+_ROWWISE_NP      = ('where', 'clip', 'round', 'around', 'nan_to_num')
+_ROWWISE_METHODS = ('astype', 'clip', 'round', 'conj')
+_ROWWISE_ATTRS   = ('real', 'imag')
+
+def rowwise_labels(node):
+    ## labels used by a row-wise formula, or None
+    if isinstance(node, ast.Constant):
+        return set()
+    if isinstance(node, ast.Name):
+        return None if node.id == 'np' else {node.id}
+    if isinstance(node, ast.Attribute):
+        if isinstance(node.value, ast.Name) and node.value.id == 'np':
+            ## np.pi, np.nan, np.float32, ...
+            return set()
+        if node.attr in _ROWWISE_ATTRS:
+            return rowwise_labels(node.value)
+        return None
+    if isinstance(node, ast.BinOp):
+        if isinstance(node.op, ast.MatMult):
+            return None
+        return union_labels([node.left, node.right])
+    if isinstance(node, ast.UnaryOp):
+        return rowwise_labels(node.operand)
+    if isinstance(node, ast.Compare):
+        return union_labels([node.left] + node.comparators)
+    if isinstance(node, ast.Subscript):
+        ## A[:, 1:3]
+        sl = node.slice
+        if isinstance(sl, ast.Tuple) and len(sl.elts) == 2 \
+                and all(isinstance(e, ast.Slice) for e in sl.elts) \
+                and sl.elts[0].lower is None and sl.elts[0].upper is None and sl.elts[0].step is None:
+            return union_labels([node.value] + [v for v in (sl.elts[1].lower, sl.elts[1].upper, sl.elts[1].step) if v])
+        return None
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        func = node.func
+        if isinstance(func.value, ast.Name) and func.value.id == 'np':
+            if not (isinstance(getattr(np, func.attr, None), np.ufunc) or func.attr in _ROWWISE_NP):
+                return None
+            if func.attr == 'where' and (len(node.args) != 3 or node.keywords):
+                ## np.where(cond) returns indices counted within each block
+                return None
+            return union_labels(node.args + [k.value for k in node.keywords])
+        if func.attr in _ROWWISE_METHODS:
+            return union_labels([func.value] + node.args + [k.value for k in node.keywords])
+    return None
+
+def union_labels(nodes):
+    labels = set()
+    for node in nodes:
+        sub = rowwise_labels(node)
+        if sub is None:
+            return None
+        labels |= sub
+    return labels
+
+def get_stream(formulas, npyfiles):
+    if args.no_stream or args.group or args.quiet or args.out or args.sparse or npyfiles \
+            or args.binary_in or args.binary_out or len(formulas) != 1:
+        return None
+    fkey, formula = formulas[0]
+    try:
+        node = ast.parse(formula, mode='eval').body
+    except SyntaxError:
+        return None
+    labels = rowwise_labels(node)
+    if labels is None or len(labels) != 1:
+        return None
+    return {'key': labels.pop(), 'fkey': fkey, 'formula': formula,
+            'code': compile(formula, '<formula>', 'eval'), 'namespace': get_namespace(),
+            'spool': tempfile.TemporaryFile(), 'block': None}
+
+def stream_rows(stream, block, data):
+    spool = stream['spool']
+    if stream['block'] is not block:
+        ## a later run of the same label replaces the former matrix
+        spool.seek(0)
+        spool.truncate()
+        stream['block'] = block
+    ans = np.asarray(eval(stream['code'], stream['namespace'], {stream['key']: data}))
+    if ans.ndim != 2 or len(ans) != len(data):
+        raise_error("Formula is not row-wise: {0}", stream['formula'])
+    write_rows(spool, stream['fkey'], ans)
+
+def print_stream(stream):
+    if stream['block'] is None:
+        ## label not found: raise NameError as usual
+        eval(stream['code'], stream['namespace'], {})
+    spool = stream['spool']
+    spool.seek(0)
+    sys.stdout.flush()
+    shutil.copyfileobj(spool, sys.stdout.buffer, 1 << 20)
+    sys.stdout.buffer.flush()
+    spool.close()
+
+def print_parse_stats(matrices, nbytes, sec):
+    print("parse: {0:,} bytes, {1} matrices in {2:.3f} s ({3:.1f} MB/s)".format(
+        nbytes, len(matrices), sec, nbytes / sec / 1e6 if sec else 0), file=sys.stderr)
+    for key, mat in matrices.items():
+        if isinstance(key, tuple):
+            key = " ".join(key)
+        print("  {0} {1} {2}".format(key, mat.shape, mat.dtype), file=sys.stderr)
+
+def split_formula(text):
+    ## '[<key>=]<formula>' -> (key, formula)
+    tmpformula = text.replace(' ','')
     eqflag = re.search(r'=', tmpformula)
     if eqflag:
-        fkey    = re.sub('=.*$', '', tmpformula) 
-        formula = re.sub('^.*?=', '', tmpformula) 
+        fkey    = re.sub('=.*$', '', tmpformula)
+        formula = re.sub('^.*?=', '', tmpformula)
     else:
         fkey    = tmpformula
         formula = tmpformula
-    #print(fkey, formula, sep=args.delimiter)
+    return fkey, formula
+
+def get_formulas():
+    ## formulas separated by ";" or lines of --formula-file
+    texts = []
+    if args.formula_file:
+        filename = re.sub(r'\\', '/', args.formula_file)
+        try:
+            with open(filename, 'r', encoding="utf-8") as f:
+                texts.extend(line for line in f if not line.lstrip().startswith('#'))
+        except OSError:
+            raise_error("Could not open file: {0}", filename)
+    if args.formula:
+        texts.append(args.formula)
+    formulas = [split_formula(piece.strip()) for text in texts
+                for piece in text.split(';') if piece.strip()]
+    if not formulas:
+        raise_error("No formula given")
+    return formulas
 
-    ## read file
-    readfile = open_file()
+def is_npy_file(filename):
+    return re.search(r'\.np[yz]$', filename, re.IGNORECASE) is not None
 
-    lineCnt = 0
-    outlist = []
-    mydict = {}
+def get_inputfile():
+    ## text or binary stream file (not .npy/.npz)
+    files = [f for f in args.inputfile or [] if not is_npy_file(f)]
+    if len(files) > 1:
+        raise_error("Only one text input file can be given: {0}", ", ".join(files))
+    return files[0] if files else None
 
-    for line in readfile:
-        lineCnt += 1
-        ## print line
-        line = line.rstrip('\r\n')
-        print(line)
-        ## read matrix as np.array
-        splitLine = line.split(args.delimiter)
-        key = splitLine.pop(0)
-        tmplist = splitLine
-        if lineCnt == 1:
-            mydict.setdefault(key, key)
-            outlist.append(tmplist)
-            lastkey = key
+def open_file(mode = 'r'):
+    inputfile = get_inputfile()
+    if inputfile and inputfile != '-':
+        filename = re.sub(r'\\', '/', inputfile)
+        try:
+            if 'b' in mode:
+                readfile = open(filename, mode)
+            else:
+                readfile = open(filename, mode, encoding="utf-8")
+        except:
+            raise_error("Could not open file: {0}", filename)
+    elif 'b' in mode:
+        readfile = sys.stdin.buffer
+    else:
+        readfile = sys.stdin
+    return readfile
+
+## binary matrix stream (--binary-in/--binary-out)
+##   frame: b'PMAT' + label length (uint32) + npy length (uint64)
+##          + label (utf-8) + npy bytes (header + raw data)
+_FRAME = struct.Struct('<4sIQ')
+_FRAME_MAGIC = b'PMAT'
+_NPY_HEADER_MAX = 65536 + 12
+
+def write_frame(out, key, mat):
+    mat = np.asarray(mat)
+    if mat.dtype.hasobject:
+        raise_error("Could not write object array as binary: {0}", key)
+    if not (mat.flags.c_contiguous or mat.flags.f_contiguous):
+        mat = np.ascontiguousarray(mat)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(mat))
+    header = header.getvalue()
+    label = key.encode('utf-8')
+    out.write(_FRAME.pack(_FRAME_MAGIC, len(label), len(header) + mat.nbytes))
+    out.write(label)
+    out.write(header)
+    out.write(mat.reshape(-1, order='A').view(np.uint8))
+
+def read_exact(readfile, size):
+    buf = bytearray(size)
+    if size and readfile.readinto(buf) != size:
+        raise_error("Truncated binary input")
+    return buf
+
+def read_npy_header(key, fp):
+    try:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+    except ValueError as e:
+        raise_error("Could not read binary matrix {0}: {1}", key, e)
+    if dtype.hasobject:
+        raise_error("Could not read object array as binary: {0}", key)
+    return shape, 'F' if fortran else 'C', dtype
+
+def load_npy(key, buf):
+    fp = io.BytesIO(bytes(memoryview(buf)[:_NPY_HEADER_MAX]))
+    shape, order, dtype = read_npy_header(key, fp)
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.empty(shape, dtype=dtype)
+    ## no copy: the array shares memory with the frame buffer
+    data = np.frombuffer(buf, dtype=dtype, count=count, offset=fp.tell())
+    return data.reshape(shape, order=order)
+
+def read_binary(readfile):
+    matrices = {}
+    nbytes = 0
+    while True:
+        head = readfile.read(_FRAME.size)
+        if not head:
+            break
+        if head[:len(_FRAME_MAGIC)] != _FRAME_MAGIC:
+            raise_error("Input is not a binary matrix stream (written by --binary-out)")
+        if len(head) < _FRAME.size:
+            raise_error("Truncated binary input")
+        magic, klen, alen = _FRAME.unpack(head)
+        key = bytes(read_exact(readfile, klen)).decode('utf-8')
+        matrices[key] = load_npy(key, read_exact(readfile, alen))
+        nbytes += _FRAME.size + klen + alen
+    return matrices, nbytes
+
+## memory-mapped .npy/.npz input (-i file.npy, -i file.npz)
+##   label: file name stem (.npy) or member name (.npz)
+##   only the pages touched by the formula are read
+def load_npy_file(filename, matrices):
+    filename = re.sub(r'\\', '/', filename)
+    if filename.lower().endswith('.npz'):
+        load_npz_file(filename, matrices)
+        return
+    key = os.path.splitext(os.path.basename(filename))[0]
+    try:
+        matrices[key] = np.load(filename, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        raise_error("Could not open file: {0}: {1}", filename, e)
+
+def load_npz_file(filename, matrices):
+    ## stored members are memory-mapped at their offset in the zip file,
+    ## compressed members (np.savez_compressed) are read into memory
+    try:
+        npz = np.load(filename)
+        f = open(filename, 'rb')
+    except (OSError, ValueError) as e:
+        raise_error("Could not open file: {0}: {1}", filename, e)
+    with npz, f:
+        for info in npz.zip.infolist():
+            key = re.sub(r'\.npy$', '', info.filename)
+            if info.compress_type == zipfile.ZIP_STORED:
+                matrices[key] = mmap_npz_member(filename, f, key, info)
+            else:
+                matrices[key] = npz[key]
+
+def mmap_npz_member(filename, f, key, info):
+    f.seek(info.header_offset)
+    local = f.read(30)
+    if local[:4] != b'PK\x03\x04':
+        raise_error("Could not read {0} in {1}", key, filename)
+    nlen, elen = struct.unpack('<HH', local[26:30])
+    f.seek(info.header_offset + 30 + nlen + elen)
+    shape, order, dtype = read_npy_header(key, f)
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order=order)
+
+def save_answers(answers):
+    ## --out file.npz: all results by label, --out file.npy: last result
+    filename = re.sub(r'\\', '/', args.out)
+    if args.sparse and any(sparse.issparse(ans) for ans in answers.values()):
+        raise_error("--out does not support sparse matrix (use .toarray())")
+    try:
+        if filename.lower().endswith('.npz'):
+            np.savez(filename, **answers)
         else:
-            if key in mydict:
-                outlist.append(tmplist)
+            np.save(filename, list(answers.values())[-1])
+    except OSError as e:
+        raise_error("Could not write file: {0}: {1}", filename, e)
+
+## sparse matrix input (--sparse)
+##   lines of "label row col value" (0-based) are built into scipy.sparse
+##   csr matrices. the shape is max index + 1 (add "label n-1 m-1 0"
+##   to set it explicitly)
+def get_namespace():
+    namespace = {'np': np}
+    if args.sparse:
+        namespace['sp'] = sparse
+        namespace['spla'] = sparse.linalg
+        namespace['spsolve'] = sparse.linalg.spsolve
+    return namespace
+
+def to_sparse(key, mat):
+    if mat.ndim != 2 or mat.shape[1] != 3:
+        raise_error("Sparse matrix {0} needs lines of 'label row col value'", key)
+    rows = np.real(mat[:, 0]).astype(np.int64)
+    cols = np.real(mat[:, 1]).astype(np.int64)
+    if len(mat) and (rows.min() < 0 or cols.min() < 0):
+        raise_error("Sparse matrix {0} has negative index", key)
+    shape = (int(rows.max()) + 1, int(cols.max()) + 1) if len(mat) else (0, 0)
+    ## duplicate entries are summed and explicit zeros are dropped
+    csr = sparse.coo_matrix((mat[:, 2], (rows, cols)), shape=shape).tocsr()
+    csr.eliminate_zeros()
+    return csr
+
+def eval_formulas(formulas, namespace, matrices):
+    ## execute formulas in order against the shared namespace
+    ## and keep each new label once (last value)
+    answers = {}
+    for fkey, formula in formulas:
+        ans = eval(formula, namespace, matrices)
+        matrices[fkey] = ans
+        answers[fkey] = ans
+    return answers
+
+## batched evaluation over groups (--group)
+##   lines of "group label val val ...". the matrices of each label are
+##   stacked over groups into 3-D arrays. a formula is evaluated once on
+##   the stack only if batch_ndim proves that it gives the same answer as
+##   evaluating it group by group (@, np.linalg.solve/inv/det/eig and
+##   elementwise operations). other formulas (.T, reductions, indexing,
+##   ...) are evaluated group by group
+_BATCH_ELEMENTWISE = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_BATCH_UFUNCS = ('abs', 'absolute', 'exp', 'log', 'log10', 'log2', 'sqrt', 'square',
+                 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh',
+                 'sign', 'floor', 'ceil', 'negative', 'conj', 'real', 'imag',
+                 'maximum', 'minimum', 'where')
+_BATCH_LINALG = ('solve', 'inv', 'det', 'eig', 'eigvals')
+
+def split_groups(matrices):
+    groups = {}
+    for (group, label), mat in matrices.items():
+        groups.setdefault(group, {})[label] = mat
+    return groups
+
+def np_func_name(node):
+    ## 'matmul' for np.matmul, 'linalg.inv' for np.linalg.inv, else None
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name) and node.id == 'np' and parts:
+        return '.'.join(reversed(parts))
+    return None
+
+def batch_elementwise(operands):
+    ## operands broadcast per group iff stacked ones have the same per-group
+    ## ndim and constants do not have more dimensions than them
+    if any(op is None for op in operands):
+        return None
+    grouped = [nd for g, nd in operands if g]
+    if not grouped:
+        return (False, max(nd for g, nd in operands))
+    nd = grouped[0]
+    if any(g != nd for g in grouped) or any(c > nd for g, c in operands if not g):
+        return None
+    return (True, nd)
+
+def batch_matmul(a, b):
+    ## stacked operands must be matrices: a stacked vector would be read as a matrix
+    if a is None or b is None or not (a[0] or b[0]):
+        return None
+    if any(g and nd != 2 for g, nd in (a, b)) or any(nd not in (1, 2) for g, nd in (a, b)):
+        return None
+    return (True, 1 if 1 in (a[1], b[1]) else 2)
+
+def batch_ndim(node, env):
+    ## (grouped, ndim per group) of an expression evaluated on the stack,
+    ## or None if it is not proven to be batch-safe.
+    ## env: name -> ndim per group of stacked values
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, complex)) \
+            and not isinstance(node.value, bool):
+        return (False, 0)
+    if isinstance(node, ast.Name):
+        return (True, env[node.id]) if node.id in env else None
+    if isinstance(node, ast.Attribute) and np_func_name(node) in ('pi', 'e'):
+        return (False, 0)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return batch_ndim(node.operand, env)
+    if isinstance(node, ast.BinOp):
+        a, b = batch_ndim(node.left, env), batch_ndim(node.right, env)
+        if isinstance(node.op, ast.MatMult):
+            return batch_matmul(a, b)
+        if isinstance(node.op, _BATCH_ELEMENTWISE):
+            return batch_elementwise([a, b])
+        return None
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        return batch_elementwise([batch_ndim(node.left, env), batch_ndim(node.comparators[0], env)])
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Call) \
+            and np_func_name(node.value.func) == 'linalg.eig' \
+            and isinstance(node.slice, ast.Constant) and node.slice.value in (0, 1):
+        ## eigenvalues or eigenvectors of np.linalg.eig(A)
+        if batch_ndim(node.value, env) is None:
+            return None
+        return (True, 1 + node.slice.value)
+    if isinstance(node, ast.Call) and not node.keywords:
+        name = np_func_name(node.func)
+        args_nd = [batch_ndim(arg, env) for arg in node.args]
+        if any(nd is None for nd in args_nd) or not any(nd[0] for nd in args_nd):
+            return None
+        if name == 'matmul' and len(args_nd) == 2:
+            return batch_matmul(*args_nd)
+        if name == 'where' and len(args_nd) != 3:
+            return None
+        if name in _BATCH_UFUNCS:
+            return batch_elementwise(args_nd)
+        if name and name.startswith('linalg.') and name[7:] in _BATCH_LINALG:
+            if any(nd != 2 for g, nd in args_nd):
+                return None
+            if name == 'linalg.solve' and len(args_nd) == 2:
+                return (True, 2)
+            if len(args_nd) != 1:
+                return None
+            return {'linalg.inv': (True, 2), 'linalg.det': (True, 0),
+                    'linalg.eigvals': (True, 1), 'linalg.eig': (True, None)}[name]
+    return None
+
+def eval_groups(formulas, namespace, groups):
+    ## returns [(group, {fkey: ans})]. per_group holds the values of each
+    ## group, stacked holds the same values stacked over groups (only
+    ## arrays of equal shape in all groups)
+    keys = list(groups)
+    per_group = [dict(groups[group]) for group in keys]
+    labels = set.intersection(*(set(mats) for mats in per_group)) if per_group else set()
+    stacked = {}
+    for label in labels:
+        mats = [values[label] for values in per_group]
+        if all(mat.shape == mats[0].shape for mat in mats):
+            stacked[label] = np.stack(mats)
+    answers = [{} for group in keys]
+    for fkey, formula in formulas:
+        env = {name: mat.ndim - 1 for name, mat in stacked.items()}
+        nd = batch_ndim(ast.parse(formula, mode='eval').body, env)
+        if nd is not None:
+            ans = eval(formula, namespace, dict(stacked))
+            if nd[1] is None:
+                ## tuple of stacked arrays (np.linalg.eig)
+                values = [tuple(item[i] for item in ans) for i in range(len(keys))]
+                stacked.pop(fkey, None)
             else:
-                ## set np.array
-                execformula = str(mydict[lastkey])
-                execformula += " = np.array(outlist, dtype=" + args.dtype + ")"
-                #print(execformula)
-                exec(execformula)
-                outlist = []
-                outlist.append(tmplist)
-                mydict.setdefault(key, key)
-                lastkey = key
-    ## set np.array
-    execformula = str(mydict[lastkey])
-    execformula += " = np.array(outlist, dtype=" + args.dtype + ")"
-    #print(execformula)
-    exec(execformula)
-
-    ## execute formula and print answer
-    ans = eval(formula)
-    if args.quiet:
+                values = [ans[i] for i in range(len(keys))]
+                stacked[fkey] = ans
+        else:
+            values = [eval(formula, namespace, per_group[i]) for i in range(len(keys))]
+            stacked.pop(fkey, None)
+            arrays = [np.asarray(v) if isinstance(v, np.ndarray) or np.isscalar(v) else None
+                      for v in values]
+            if values and all(a is not None and a.shape == arrays[0].shape for a in arrays):
+                stacked[fkey] = np.stack(arrays)
+        for i, value in enumerate(values):
+            per_group[i][fkey] = value
+            answers[i][fkey] = value
+    return list(zip(keys, answers))
+
+def emit_matrix(key, mat):
+    if args.sparse and sparse.issparse(mat):
+        if args.binary_out:
+            raise_error("--binary-out does not support sparse matrix: {0} (use .toarray())", key)
+        print_sparse(key, mat)
+    elif args.binary_out:
+        sys.stdout.flush()
+        write_frame(sys.stdout.buffer, key, mat)
+    else:
+        print_matrix(key, mat)
+
+if __name__ == '__main__':
+    # get args
+    args = get_args()
+    if args.threads:
+        set_blas_threads(args.threads)
+    import numpy as np
+    if args.threads:
+        limit_blas_threads(args.threads)
+    if args.blas_info:
+        print_blas_info()
+    formulas = get_formulas()
+    if args.group and (args.binary_in or args.binary_out or args.sparse or args.inputfile and any(map(is_npy_file, args.inputfile))):
+        raise_error("--group can not be used with --binary-in, --binary-out, --sparse or .npy input")
+    if args.sparse:
+        import scipy.sparse as sparse
+        import scipy.sparse.linalg
+
+    ## read matrices into a plain dict namespace
+    t = time.perf_counter()
+    npyfiles = [f for f in args.inputfile or [] if is_npy_file(f)]
+    matrices, nbytes = {}, 0
+    if get_inputfile() or not npyfiles:
+        readfile = open_file('rb' if args.binary_in else 'r')
+        stream = get_stream(formulas, npyfiles)
+        if stream is not None:
+            ## row-wise formula: evaluate while reading
+            matrices, nbytes = read_matrices(readfile, stream=stream)
+            if args.parse_stats:
+                print_parse_stats(matrices, nbytes, time.perf_counter() - t)
+            print_stream(stream)
+            sys.exit(0)
+        if args.binary_in:
+            matrices, nbytes = read_binary(readfile)
+        else:
+            ## text input is echoed as it is unless --binary-out
+            matrices, nbytes = read_matrices(readfile, echo=not args.binary_out)
+            if args.sparse:
+                matrices = {key: to_sparse(key, mat) for key, mat in matrices.items()}
+        if args.binary_in or args.binary_out:
+            for key, mat in matrices.items():
+                emit_matrix(key, mat)
+    ## .npy/.npz input is memory-mapped and not echoed
+    for filename in npyfiles:
+        load_npy_file(filename, matrices)
+    if args.parse_stats:
+        print_parse_stats(matrices, nbytes, time.perf_counter() - t)
+
+    ## execute formulas and print answers
+    namespace = get_namespace()
+    if args.group:
+        results = eval_groups(formulas, namespace, split_groups(matrices))
+        delim = get_delimiter()
+        answers = {group + '/' + fkey: ans for group, group_answers in results
+                   for fkey, ans in group_answers.items()}
+    else:
+        answers = eval_formulas(formulas, namespace, matrices)
+    if args.out:
+        save_answers(answers)
+    elif args.quiet:
         pass
         #print(ans)
+    elif args.group:
+        for group, group_answers in results:
+            for fkey, ans in group_answers.items():
+                emit_matrix(group + delim + fkey, np.atleast_1d(ans))
     else:
-        print_matrix(fkey, ans)
+        for fkey, ans in answers.items():
+            emit_matrix(fkey, ans)
+    sys.stdout.flush()
 
     sys.exit(0)
 
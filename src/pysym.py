@@ -10,15 +10,14 @@ import re
 import argparse
 import ast # For multi-line script parsing
 import math
-import numpy as np
-#import pandas as pd
-import sympy
-from sympy import sin, cos, tan, atan, log, I, pi, E, exp, sqrt
-from sympy import symbols
-from sympy import Eq, solve, diff, integrate, factorial, factor, summation
-from sympy import Matrix, plot
-from sympy.printing.dot import dotprint
-#from sympy.abc import x
+import itertools
+import hashlib
+import json
+import pickle
+import subprocess
+import tempfile
+import time
+## numpy and sympy are imported in __main__ after the cache lookup
 
 _version = "Sun 31 Aug 2025 17:00:00 JST"
 _code    = "MyCommands(LINUX+WINDOWS/PYTHON3/UTF-8)"
@@ -46,6 +45,7 @@ def get_args():
     Usage:
         pysym.py '<formula>' [--latex|--simplify]
         pysym.py <file>      [--latex|--simplify]
+        pysym.py '<formula>' -i <datafile|->  [-d <delimiter>]
 
     Examples:
         formula: pysym.py 'x**2 - 2*x - 15' [--latex|--simplify]
@@ -58,6 +58,16 @@ def get_args():
         - If the last line of a script is an expression, its result is printed.
         - Use --latex to convert the final result to LaTeX format.
         - The --sympify option is only recommended for simple, single-line expressions.
+        - Printed results are cached on disk (~/.cache/pysym) and replayed
+          when the same script is run again. Use --no-cache to disable.
+        - Use --cse to hoist common subexpressions, and --codegen python|numpy|c
+          to output the result as a function.
+        - Use --timeout SECONDS and --max-memory MB to run the script in a
+          worker process that is killed when a limit is exceeded.
+        - Use --profile to print wall time and peak memory per top-level
+          statement to stderr.
+        - With -i, the result is compiled by sympy.lambdify and evaluated
+          over the columns of a data file or stdin (-i -).
     """
 
     help_epi_msg = r"""EXAMPLES:
@@ -371,6 +381,153 @@ def get_args():
     The definite integral of sin(x) from 0 to pi is:
     2
     ```
+
+    #
+    # Common subexpressions and code generation
+    #
+
+    # --cse: hoist shared subterms as x0, x1, ... (sympy.cse)
+    pysym.py 'sympy.sin(x+y)**2 + sympy.sqrt(sympy.sin(x+y)+1)/(x+y)' --cse
+    x0 = x + y
+    x1 = sin(x0)
+    x1**2 + sqrt(x1 + 1)/x0
+
+    # --codegen python|numpy|c: output a function f with the
+    # subexpressions hoisted. Arguments are the free symbols by name.
+    pysym.py 'sympy.sin(x+y)**2 + sympy.sqrt(sympy.sin(x+y)+1)/(x+y)' --codegen numpy
+    import numpy
+
+    def f(x, y):
+        x0 = x + y
+        x1 = numpy.sin(x0)
+        return x1**2 + numpy.sqrt(x1 + 1)/x0
+
+    pysym.py 'sympy.sin(x+y)**2 + sympy.sqrt(sympy.sin(x+y)+1)/(x+y)' --codegen c
+    #include <math.h>
+
+    double f(double x, double y) {
+        double x0, x1, result;
+        x0 = x + y;
+        x1 = sin(x0);
+        result = pow(x1, 2) + sqrt(x1 + 1)/x0;
+        return result;
+    }
+
+    Notes:
+        - Matrices and lists are returned as nested lists (python),
+          numpy.array (numpy), or written to double *out in row-major
+          order (c).
+        - Use -s to simplify the result before --cse/--codegen.
+
+    #
+    # Numeric evaluation over data columns (-i)
+    #
+
+    The answer is compiled once with sympy.lambdify(..., 'numpy') and
+    evaluated vectorized over the columns of a data file (-i <file>) or
+    stdin (-i -). The first line is a header: its names are bound to the
+    symbols of the answer. Each row is printed with the result appended
+    as the "ans" column. Rows are processed in blocks of 65536 lines.
+
+    cat data.txt
+    x y
+    1 2
+    3 4
+
+    pysym.py 'x**2 + y' -i data.txt
+    x y ans
+    1 2 3.0
+    3 4 13.0
+
+    # comma separated from stdin
+    cat data.csv | pysym.py 'sympy.sqrt(x)*y' -d "," -i -
+    x,y,ans
+    4,1,2.0
+    9,2,6.0
+
+    Notes:
+        - All symbols of the answer must be in the header.
+        - Use -s to simplify the answer before compiling.
+        - The result cache is not used with -i.
+
+    #
+    # Timeout and memory limit
+    #
+
+    With --timeout SECONDS and/or --max-memory MB, the script runs in a
+    worker process. When a limit is exceeded, the worker is killed and
+    the running top-level statement and the elapsed time are reported.
+    The exit status is 1.
+
+    # stop a runaway simplify after 60 seconds
+    pysym.py script.py --timeout 60
+    Error[pysym.py]: Timeout (60.0 s) after 60.0 s in statement 3/4 (line 5): e = sympy.simplify(e)
+
+    # allow the script to allocate 2 GB on top of the interpreter
+    pysym.py script.py --max-memory 2048
+    Error[pysym.py]: Memory limit exceeded after 12.3 s in statement 2/4 (line 3): s = sympy.solve(eqs, ...
+
+    Notes:
+        - The timeout includes the startup of the worker (about 1 s for
+          importing SymPy).
+        - --max-memory limits the address space (RLIMIT_AS) of the worker and
+          needs the resource module (Linux). It is ignored with a warning
+          on other platforms.
+        - A cache hit is printed without starting the worker.
+
+    #
+    # Per-statement profile
+    #
+
+    --profile prints the wall time and the peak traced memory (tracemalloc)
+    of each top-level statement and of the output step as a table on
+    stderr. --profile-top N also prints the top N functions by
+    cumulative time (cProfile).
+
+    pysym.py deriv.py --profile
+    0
+    stmt      line    time(s)      %   peak(MB)  source
+    1/5          1      0.007    0.1       0.06  f = sympy.exp(x)*sympy.sin(x)**3
+    2/5          2      4.905   95.4       6.44  F = sympy.integrate(f, x)
+    3/5          3      0.101    2.0       5.49  sols = sympy.solve(x**3 - 2*x + 1, x)
+    4/5          4      0.001    0.0       5.47  M = sympy.Matrix(3, 3, lambda i, j: x**(i+j))
+    5/5          5      0.127    2.5       5.50  sympy.simplify(sympy.diff(F, x) - f)
+    output              0.000    0.0       5.47
+    total               5.140  100.0       6.44
+
+    Notes:
+        - Peak memory includes objects kept from earlier statements.
+        - tracemalloc and cProfile slow the script down. The result cache is
+          not used with --profile.
+        - The table is also printed when the script fails.
+
+    #
+    # Result cache
+    #
+
+    The printed output of a script is saved in ~/.cache/pysym
+    (or --cache-dir <dir>). The key is the parsed script (comments and
+    spacing are ignored), -v/-m definitions, output options and the
+    SymPy version. A repeated run prints the saved output without
+    importing SymPy or evaluating the script.
+
+    # first run: evaluates (slow)
+    pysym.py 'sympy.integrate(x**2*sympy.exp(x)*sympy.sin(x), x)'
+    # second run: replayed from the cache (fast)
+    pysym.py 'sympy.integrate(x**2*sympy.exp(x)*sympy.sin(x), x)'
+
+    # evaluate again without reading or writing the cache
+    pysym.py 'sympy.integrate(x**2*sympy.exp(x)*sympy.sin(x), x)' --no-cache
+
+    # remove all cache files
+    pysym.py --clear-cache
+
+    Notes:
+        - When the total size exceeds --cache-size MB (default: 100),
+          the least recently used files are removed.
+        - Scripts that plot, and scripts that fail, are not cached.
+        - Scripts are assumed to be deterministic. Use --no-cache for
+          scripts that read files, random numbers or the clock.
     """
 
     parser = argparse.ArgumentParser(description=help_desc_msg,
@@ -378,23 +535,36 @@ def get_args():
                     formatter_class=argparse.RawDescriptionHelpFormatter)
     tp = lambda x:list(map(str, x.split(',')))
     sp = lambda x:list(map(str, x.split(';')))
-    parser.add_argument("formula", help="python script or file", type=str)
+    parser.add_argument("formula", help="python script or file", type=str, nargs='?')
     parser.add_argument("-l", "--latex", help="output latex formula", action="store_true")
     parser.add_argument("-u", "--unicode", help="use unicode print", action="store_true")
     parser.add_argument("-s", "--simplify", help="simplify", action="store_true")
     parser.add_argument("--sympify", help="sympify (for simple expressions only)", action="store_true")
     parser.add_argument("--dot", help="output dot file format", action="store_true")
     parser.add_argument("--eq", help="output formula = answer", action="store_true")
+    parser.add_argument("--cse", help="output common subexpressions and reduced answer", action="store_true")
+    parser.add_argument("--codegen", help="output answer as a function with subexpressions hoisted",
+        choices=["python", "numpy", "c"])
     parser.add_argument("-d", "--delimiter", help="line separator(delimiter)", default=r' ',
         choices=[r" ", r",", r"\t"])
     parser.add_argument("-m", "--module", help='<modules>,...', type=tp)
     parser.add_argument("-v", "--variable", help='<variable>=<string>;...', type=sp)
-    #parser.add_argument("-i", "--inputfile", help='input from data file', type=str)
+    parser.add_argument("-i", "--inputfile", help='evaluate the answer over data file columns (- for stdin)', type=str)
     parser.add_argument('--size', help='graph size: w inch, h inch', type=tp)
     parser.add_argument("--grid", help="Add grid to plot using seaborn-whitegrid", action="store_true")
     parser.add_argument("--style", help="Show plot style", action="store_true")
+    parser.add_argument("--timeout", help="kill the script after SECONDS (runs in a worker process)", default=None, type=float)
+    parser.add_argument("--max-memory", help="limit memory of the script to MB (runs in a worker process)", default=None, type=int)
+    parser.add_argument("--profile", help="print wall time and peak memory per statement to stderr", action="store_true")
+    parser.add_argument("--profile-top", help="with --profile, also print top N functions by cProfile", default=0, type=int)
+    parser.add_argument("--no-cache", help="do not use result cache", action="store_true")
+    parser.add_argument("--clear-cache", help="remove all cache files", action="store_true")
+    parser.add_argument("--cache-dir", help="cache directory (default: ~/.cache/pysym)", default=None, type=str)
+    parser.add_argument("--cache-size", help="max total cache size in MB", default=100, type=int)
     parser.add_argument("--debug", help="output dataframe", action="store_true")
     args = parser.parse_args()
+    if args.formula is None and not args.clear_cache:
+        parser.error("the following arguments are required: formula")
     return(args)
 
 def open_file():
@@ -402,6 +572,10 @@ def open_file():
         readfile = sys.stdin
     else:
         readfile = re.sub(r'\\', '/', args.inputfile)
+        try:
+            readfile = open(readfile, 'r', encoding='utf-8')
+        except OSError as e:
+            raise_error("Failed to read file: {0}\n{1}", args.inputfile, e)
     return readfile
 
 def __get_values(vals):
@@ -410,6 +584,444 @@ def __get_values(vals):
         equations.append(str(val).strip())
     return equations
 
+## on-disk result cache
+##   key: parsed script, -v/-m definitions, output options, sympy version
+##   value: printed output and srepr of the answer
+_CACHE_IGNORE = ('formula', 'no_cache', 'clear_cache', 'cache_dir', 'cache_size')
+
+def get_cache_dir():
+    if args.cache_dir:
+        return re.sub(r'\\', '/', args.cache_dir)
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pysym')
+
+def get_sympy_version():
+    ## read from package metadata so that a cache hit does not import sympy
+    try:
+        from importlib.metadata import version
+        return version('sympy')
+    except Exception:
+        return ''
+
+def normalize_script(script_code):
+    ## comments and spacing do not change the key
+    try:
+        return ast.dump(ast.parse(script_code))
+    except SyntaxError:
+        return script_code
+
+def get_cache_path(script_code):
+    opts = sorted((k, v) for k, v in vars(args).items() if k not in _CACHE_IGNORE)
+    key = [normalize_script(script_code), opts, get_sympy_version(), sys.version_info[:2]]
+    key = json.dumps(key, default=str)
+    return os.path.join(get_cache_dir(), hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+
+def is_cacheable(script_code):
+    ## plots are side effects, not printed results
+    if args.no_cache or args.style or args.debug or args.inputfile or args.profile or args.profile_top:
+        return False
+    texts = [script_code] + (args.variable or []) + (args.module or [])
+    return not any(re.search(r'plot|plt', t) for t in texts)
+
+def clear_cache():
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            os.remove(os.path.join(cache_dir, name))
+
+def evict_cache():
+    ## remove least recently used files until total size <= --cache-size MB
+    cache_dir = get_cache_dir()
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            path = os.path.join(cache_dir, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+    total = sum(f[1] for f in files)
+    limit = args.cache_size * 1024 * 1024
+    for mtime, size, path in sorted(files):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
+
+def read_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            entry = pickle.load(f)
+        ## mark as recently used
+        os.utime(cache_path)
+        return entry
+    except Exception:
+        return None
+
+def write_cache(cache_path, text, ans):
+    try:
+        result = sympy.srepr(ans)
+    except Exception:
+        result = None
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        tmp_path = cache_path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'output': text, 'result': result}, f)
+        os.replace(tmp_path, cache_path)
+        evict_cache()
+    except OSError as e:
+        print("Warning: could not write cache: {0}".format(e), file=sys.stderr)
+
+class TeeOutput:
+    ## write to stdout and keep a copy for the cache
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = io.StringIO()
+        self.bypassed = False
+    def write(self, s):
+        self.copy.write(s)
+        return self.stream.write(s)
+    def writelines(self, lines):
+        for s in lines:
+            self.write(s)
+    def flush(self):
+        self.stream.flush()
+    def getvalue(self):
+        return self.copy.getvalue()
+    ## output written to .buffer or fileno() is not copied, and output
+    ## depending on isatty() differs by terminal: such runs are not cached
+    def fileno(self):
+        self.bypassed = True
+        return self.stream.fileno()
+    def isatty(self):
+        self.bypassed = True
+        return self.stream.isatty()
+    @property
+    def buffer(self):
+        self.bypassed = True
+        return self.stream.buffer
+    def __getattr__(self, name):
+        ## encoding, errors, ... of the wrapped stream
+        return getattr(self.stream, name)
+
+## numeric evaluation over data columns (-i)
+##   the answer is compiled once by lambdify and applied to row blocks
+_BLOCK_ROWS = 1 << 16
+
+def get_delimiter():
+    if args.delimiter == r'\t':
+        return '\t'
+    return args.delimiter
+
+def split_line(line, delim):
+    if delim == ' ':
+        return line.split()
+    return line.rstrip('\r\n').split(delim)
+
+def get_numeric_func(ans, names):
+    ## bind header names to the symbols of the answer (keeping assumptions)
+    if isinstance(ans, (list, tuple, dict, set)) or getattr(ans, 'is_Matrix', False):
+        raise_error("Numeric mode needs a scalar expression, got: {0}", type(ans).__name__)
+    expr = sympy.sympify(ans)
+    free = {str(s): s for s in expr.free_symbols}
+    missing = sorted(set(free) - set(names))
+    if missing:
+        raise_error("Symbols not found in header: {0}", ", ".join(missing))
+    syms = [free.get(n, sympy.Symbol(n)) for n in names]
+    return sympy.lambdify(syms, expr, 'numpy')
+
+def parse_block(lines, ncol, delim, lineno):
+    text = '\n'.join(lines)
+    if delim != ' ':
+        text = text.replace(delim, ' ')
+    try:
+        data = np.array(text.split(), dtype=float)
+    except ValueError as e:
+        raise_error("Non-numeric value near line {0}: {1}", lineno, e)
+    if data.size != len(lines) * ncol:
+        raise_error("Column count does not match header near line {0}", lineno)
+    return data.reshape(len(lines), ncol)
+
+def eval_numeric(ans, readfile):
+    delim = get_delimiter()
+    header = readfile.readline()
+    names = split_line(header, delim)
+    if not names:
+        return
+    func = get_numeric_func(ans, names)
+    write = sys.stdout.write
+    write(header.rstrip('\r\n') + delim + 'ans' + '\n')
+    lineno = 2
+    while True:
+        block = list(itertools.islice(readfile, _BLOCK_ROWS))
+        if not block:
+            break
+        lines = [l.rstrip('\r\n') for l in block if l.strip()]
+        start, lineno = lineno, lineno + len(block)
+        if not lines:
+            continue
+        data = parse_block(lines, len(names), delim, start)
+        with np.errstate(all='ignore'):
+            res = np.broadcast_to(func(*data.T), (len(lines),))
+        ## numpy scalar str is faster than str of python float
+        write(''.join(map(''.join, zip(lines, itertools.repeat(delim), map(str, res), itertools.repeat('\n')))))
+
+## common subexpression elimination (--cse) and code generation (--codegen)
+def get_cse(ans):
+    ## hoist shared subexpressions as x0, x1, ... (skipping names used in ans)
+    is_seq = isinstance(ans, (list, tuple))
+    exprs = [sympy.sympify(e) for e in (ans if is_seq else [ans])]
+    params = sorted(set().union(*[getattr(e, 'free_symbols', set()) for e in exprs]), key=str)
+    temps = sympy.numbered_symbols('x', exclude=params)
+    replacements, reduced = sympy.cse(exprs, symbols=temps)
+    if not is_seq:
+        reduced = reduced[0]
+    return replacements, reduced, params
+
+def print_cse(ans, latex=False):
+    replacements, reduced, params = get_cse(ans)
+    for sym, sub in replacements:
+        if latex:
+            print(sympy.latex(sym) + " = " + sympy.latex(sub))
+        else:
+            print("{0} = {1}".format(sym, sub))
+    output(reduced, latex=latex)
+
+def indent(text, level=1):
+    return '\n'.join('    ' * level + line for line in text.splitlines())
+
+def codegen_c(replacements, reduced, params):
+    from sympy.printing.c import C99CodePrinter
+    printer = C99CodePrinter()
+    if isinstance(reduced, sympy.MatrixBase):
+        outputs = list(reduced)
+    elif isinstance(reduced, (list, tuple)):
+        outputs = list(reduced)
+    else:
+        outputs = None
+    args_str = ', '.join('double ' + str(p) for p in params)
+    temps = [str(sym) for sym, sub in replacements]
+    body = [printer.doprint(sub, assign_to=sym) for sym, sub in replacements]
+    if outputs is None:
+        ## return through a variable so that unsupported-function comments stay valid C
+        sig = 'double f({0})'.format(args_str or 'void')
+        temps.append('result')
+        body.append(printer.doprint(reduced, assign_to=sympy.Symbol('result')))
+        body.append('return result;')
+    else:
+        ## matrices are written to out in row-major order
+        out = sympy.MatrixSymbol('out', len(outputs), 1)
+        sig = 'void f({0})'.format(', '.join(filter(None, [args_str, 'double *out'])))
+        for i, e in enumerate(outputs):
+            body.append(printer.doprint(sympy.sympify(e), assign_to=out[i]))
+    if temps:
+        body.insert(0, 'double {0};'.format(', '.join(temps)))
+    ## the printer does not register math.h for pow()
+    headers = set(printer.headers)
+    if any(re.search(r'\w\(', b) for b in body):
+        headers.add('math.h')
+    lines = ['#include <{0}>'.format(h) for h in sorted(headers)]
+    if lines:
+        lines.append('')
+    lines.append(sig + ' {')
+    lines.extend(indent(b) for b in body)
+    lines.append('}')
+    return '\n'.join(lines)
+
+def codegen_python(replacements, reduced, params, lang):
+    if lang == 'numpy':
+        from sympy.printing.numpy import NumPyPrinter
+        printer = NumPyPrinter()
+    else:
+        from sympy.printing.pycode import PythonCodePrinter
+        printer = PythonCodePrinter()
+        if isinstance(reduced, sympy.MatrixBase):
+            reduced = reduced.tolist()
+    body = []
+    for lhs, expr in [(str(sym) + ' = ', sub) for sym, sub in replacements] + [('return ', reduced)]:
+        ## unsupported functions are reported as comment lines before the expression
+        text = printer.doprint(expr).splitlines()
+        body.extend(text[:-1])
+        body.append(lhs + text[-1])
+    lines = ['import {0}'.format(m) for m in sorted(printer.module_imports)]
+    if lines:
+        lines.append('')
+    lines.append('def f({0}):'.format(', '.join(str(p) for p in params)))
+    lines.extend(indent(b.strip()) for b in body)
+    return '\n'.join(lines)
+
+def codegen(ans, lang):
+    if not (isinstance(ans, (list, tuple, sympy.Basic, int, float)) or getattr(ans, 'is_Matrix', False)) \
+            or isinstance(ans, sympy.Dict):
+        raise_error("--codegen needs an expression, matrix or list, got: {0}", type(ans).__name__)
+    if isinstance(ans, (list, tuple)):
+        ## elements are written to out[i] (c) or returned as a list
+        for e in ans:
+            e = sympy.sympify(e)
+            if not (isinstance(e, sympy.Expr) or lang != 'c' and getattr(e, 'is_Matrix', False)):
+                raise_error("--codegen needs expressions in the list, got: {0}", type(e).__name__)
+    replacements, reduced, params = get_cse(ans)
+    if lang == 'c':
+        return codegen_c(replacements, reduced, params)
+    return codegen_python(replacements, reduced, params, lang)
+
+## statement-by-statement execution and worker process (--timeout, --max-memory)
+##   the parent re-runs this script with PYSYM_WORKER=<status file>.
+##   the worker writes the running top-level statement to the status file
+##   so that the parent can report it when the worker is killed.
+_WORKER_ENV = 'PYSYM_WORKER'
+_running = {'desc': '', 'start': 0.0, 'file': None}
+
+def get_statement(node, script_code, i, total):
+    ## (label, line, first line of source) of a top-level statement
+    src = (ast.get_source_segment(script_code, node) or '').strip()
+    src = src.splitlines()[0] if src else ''
+    if len(src) > 60:
+        src = src[:57] + '...'
+    return ("{0}/{1}".format(i, total), node.lineno, src)
+
+def set_running(label, lineno=None, src=''):
+    if lineno is None:
+        desc = label
+    else:
+        desc = "statement {0} (line {1}): {2}".format(label, lineno, src)
+    _running['desc'] = desc
+    if _running['file']:
+        _running['file'].write(desc + '\n')
+        _running['file'].flush()
+    if _profile['rows'] is not None:
+        start_profile_row(label, lineno, src)
+
+def get_elapsed():
+    return time.perf_counter() - _running['start']
+
+def exec_statements(nodes, script_code, total):
+    for i, node in enumerate(nodes, 1):
+        set_running(*get_statement(node, script_code, i, total))
+        exec(compile(ast.Module(body=[node], type_ignores=[]), '<string>', 'exec'), globals())
+
+## per-statement profile (--profile, --profile-top)
+##   wall time and peak traced memory (tracemalloc) between set_running calls
+_profile = {'rows': None, 'current': None, 'start': 0.0, 'cprofile': None}
+
+def start_profile():
+    import tracemalloc
+    tracemalloc.start()
+    _profile['rows'] = []
+    if args.profile_top:
+        import cProfile
+        _profile['cprofile'] = cProfile.Profile()
+        _profile['cprofile'].enable()
+
+def close_profile_row():
+    import tracemalloc
+    if _profile['current'] is None:
+        return
+    seconds = time.perf_counter() - _profile['start']
+    peak = tracemalloc.get_traced_memory()[1]
+    _profile['rows'].append(_profile['current'] + (seconds, peak))
+    _profile['current'] = None
+
+def start_profile_row(label, lineno, src):
+    import tracemalloc
+    close_profile_row()
+    tracemalloc.reset_peak()
+    _profile['current'] = (label, lineno, src)
+    _profile['start'] = time.perf_counter()
+
+def print_profile():
+    ## table on stderr: stdout stays the result
+    import tracemalloc
+    close_profile_row()
+    if _profile['cprofile']:
+        _profile['cprofile'].disable()
+    tracemalloc.stop()
+    rows = _profile['rows']
+    total = sum(r[3] for r in rows)
+    err = sys.stderr
+    print("{0:<8}{1:>6}{2:>11}{3:>7}{4:>11}  {5}".format(
+        'stmt', 'line', 'time(s)', '%', 'peak(MB)', 'source'), file=err)
+    for label, lineno, src, seconds, peak in rows:
+        print("{0:<8}{1:>6}{2:11.3f}{3:7.1f}{4:11.2f}  {5}".format(
+            label, '' if lineno is None else lineno, seconds,
+            100 * seconds / total if total else 0, peak / 1024 / 1024, src).rstrip(), file=err)
+    print("{0:<8}{1:>6}{2:11.3f}{3:7.1f}{4:11.2f}".format(
+        'total', '', total, 100 if total else 0,
+        max([r[4] for r in rows] or [0]) / 1024 / 1024), file=err)
+    if _profile['cprofile']:
+        import pstats
+        stats = pstats.Stats(_profile['cprofile'], stream=err)
+        stats.sort_stats('cumulative').print_stats(args.profile_top)
+
+def set_memory_limit(mb):
+    ## limit the address space to its current size + mb (posix only)
+    try:
+        import resource
+    except ImportError:
+        print("Warning: --max-memory is not supported on this platform", file=sys.stderr)
+        return
+    base = 0
+    try:
+        with open('/proc/self/statm') as f:
+            base = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = base + mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def start_worker(status_path):
+    _running['file'] = open(status_path, 'a', encoding='utf-8')
+    if args.max_memory:
+        set_memory_limit(args.max_memory)
+
+def read_status(status_path):
+    try:
+        with open(status_path, 'r', encoding='utf-8') as f:
+            lines = [l.strip() for l in f if l.strip()]
+    except OSError:
+        lines = []
+    return lines[-1] if lines else "startup"
+
+def kill_worker(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def run_worker():
+    ## re-run this script in a subprocess and wait at most --timeout seconds
+    fd, status_path = tempfile.mkstemp(prefix='pysym-', suffix='.status')
+    os.close(fd)
+    env = dict(os.environ)
+    env[_WORKER_ENV] = status_path
+    cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(cmd, env=env)
+        try:
+            returncode = proc.wait(timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            kill_worker(proc)
+            raise_error("Timeout ({0} s) after {1:.1f} s in {2}",
+                args.timeout, time.perf_counter() - start, read_status(status_path))
+        except KeyboardInterrupt:
+            kill_worker(proc)
+            raise
+        if returncode < 0:
+            ## killed by a signal (e.g. out of memory)
+            raise_error("Worker killed by signal {0} after {1:.1f} s in {2}",
+                -returncode, time.perf_counter() - start, read_status(status_path))
+        return returncode
+    finally:
+        os.remove(status_path)
+
 def output(ans, simplify=False, latex=False):
     if ans is None: # Do nothing if only exec is used and no result is returned
         return
@@ -429,6 +1041,12 @@ if __name__ == '__main__':
     # get args
     args = get_args()
 
+    # clear cache
+    if args.clear_cache:
+        clear_cache()
+        if args.formula is None:
+            sys.exit(0)
+
     # If args.formula is a file, read its content.
     formula_str = ""
     is_file = os.path.isfile(args.formula)
@@ -441,6 +1059,43 @@ if __name__ == '__main__':
     else:
         formula_str = args.formula
 
+    script_code = formula_str.strip()
+    if not script_code:
+        sys.exit(0)
+
+    # The --sympify option applies only to simple single-line expressions.
+    if args.sympify:
+        if is_file or '\n' in script_code or ';' in script_code:
+            print("Warning: --sympify option is ignored for files or multi-line/multi-statement scripts.", file=sys.stderr)
+        else:
+            script_code = f"sympy.sympify('{script_code}')"
+
+    # replay the printed output of the same script
+    cache_path = None
+    if is_cacheable(script_code):
+        cache_path = get_cache_path(script_code)
+        entry = read_cache(cache_path)
+        if entry is not None:
+            sys.stdout.write(entry['output'])
+            sys.exit(0)
+
+    # run the script in a worker process with --timeout/--max-memory
+    if (args.timeout or args.max_memory) and not os.environ.get(_WORKER_ENV):
+        sys.exit(run_worker())
+
+    if cache_path:
+        sys.stdout = TeeOutput(sys.stdout)
+
+    import numpy as np
+    #import pandas as pd
+    import sympy
+    from sympy import sin, cos, tan, atan, log, I, pi, E, exp, sqrt
+    from sympy import symbols
+    from sympy import Eq, solve, diff, integrate, factorial, factor, summation
+    from sympy import Matrix, plot
+    from sympy.printing.dot import dotprint
+    #from sympy.abc import x
+
     # import matplotlib
     if re.search(r'plot|plt', formula_str):
         import matplotlib.pyplot as plt
@@ -491,24 +1146,12 @@ if __name__ == '__main__':
             valStr = str(eq).strip()
             exec(valStr)
 
-    # read data
-    #if args.inputfile:
-    #    readfile = open_file()
-    #    data = np.loadtxt(readfile, delimiter=args.delimiter)
-    #    print(data)
-    
     # <<< START: MODIFICATION FOR MULTI-LINE SCRIPT EXECUTION >>>
-    script_code = formula_str.strip()
-    if not script_code:
-        sys.exit(0)
-
-    # The --sympify option applies only to simple single-line expressions.
-    if args.sympify:
-        if is_file or '\n' in script_code or ';' in script_code:
-            print("Warning: --sympify option is ignored for files or multi-line/multi-statement scripts.", file=sys.stderr)
-        else:
-            script_code = f"sympy.sympify('{script_code}')"
-
+    _running['start'] = time.perf_counter()
+    if os.environ.get(_WORKER_ENV):
+        start_worker(os.environ[_WORKER_ENV])
+    if args.profile or args.profile_top:
+        start_profile()
     try:
         # Parse the script into an AST (Abstract Syntax Tree).
         tree = ast.parse(script_code)
@@ -522,12 +1165,11 @@ if __name__ == '__main__':
             # Check whether the last node is an expression (ast.Expr).
             if isinstance(last_node, ast.Expr):
                 # Separate the last expression from the preceding statements.
-                if len(tree.body) > 1:
-                    exec_module = ast.Module(body=tree.body[:-1], type_ignores=[])
-                    exec_code = compile(exec_module, '<string>', 'exec')
-                    exec(exec_code, globals())
+                # Statements are executed one by one so that the running one is known.
+                exec_statements(tree.body[:-1], script_code, len(tree.body))
                 
                 # Evaluate the last expression.
+                set_running(*get_statement(last_node, script_code, len(tree.body), len(tree.body)))
                 eval_expression = ast.Expression(body=last_node.value)
                 eval_code = compile(eval_expression, '<string>', 'eval')
                 ans = eval(eval_code, globals())
@@ -536,7 +1178,20 @@ if __name__ == '__main__':
         # Output the result only if an expression is evaluated
         # (i.e., when the script ends with an expression).
         if evaluated:
-            if args.dot:
+            set_running("output")
+            if args.inputfile:
+                if args.simplify:
+                    ans = sympy.simplify(ans)
+                eval_numeric(ans, open_file())
+            elif args.codegen:
+                if args.simplify:
+                    ans = sympy.simplify(ans)
+                print(codegen(ans, args.codegen))
+            elif args.cse:
+                if args.simplify:
+                    ans = sympy.simplify(ans)
+                print_cse(ans, latex=args.latex)
+            elif args.dot:
                 print(dotprint(sympy.simplify(ans)))
             elif args.eq:
                 # ast.get_source_segment is available in Python 3.8+.
@@ -555,11 +1210,22 @@ if __name__ == '__main__':
                 output(ans, simplify=args.simplify, latex=args.latex)
         else:
             # If the last line is not an expression
-            # (e.g., an assignment), simply execute the entire script with exec.
-            exec(script_code, globals())
+            # (e.g., an assignment), simply execute the entire script.
+            exec_statements(tree.body, script_code, len(tree.body))
 
+    except MemoryError:
+        raise_error("Memory limit exceeded after {0:.1f} s in {1}", get_elapsed(), _running['desc'])
     except Exception as e:
         raise_error("Script execution error: {0}", e)
+    finally:
+        ## also printed when the script fails
+        if _profile['rows'] is not None:
+            print_profile()
 
     # <<< END: MODIFICATION >>>
+    if cache_path:
+        tee = sys.stdout
+        sys.stdout = tee.stream
+        if not tee.bypassed:
+            write_cache(cache_path, tee.getvalue(), ans)
     sys.exit(0)
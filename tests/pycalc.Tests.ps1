@@ -0,0 +1,262 @@
+BeforeAll {
+    $com = "$PSScriptRoot/../src/pycalc.py"
+    if ( $IsWindows ){
+        $py = "python"
+    } else {
+        $py = "python3"
+    }
+}
+
+Describe "pycalc" {
+    Context "when --chunksize is given" {
+        It "sum is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.v.sum()"
+            $stdin | & $py $com -d ',' "df.v.sum()" --chunksize 2 | Should -Be $expected
+        }
+        It "mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.v.mean()"
+            $stdin | & $py $com -d ',' "df.v.mean()" --chunksize 2 | Should -Be $expected
+        }
+        It "groupby sum is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.groupby('k').sum()"
+            $stdin | & $py $com -d ',' "df.groupby('k').sum()" --chunksize 2 | Should -Be $expected
+        }
+        It "groupby as_index=False is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.groupby('k', as_index=False).sum()"
+            $stdin | & $py $com -d ',' "df.groupby('k', as_index=False).sum()" --chunksize 2 | Should -Be $expected
+        }
+        It "mask with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,2",
+                "a,10",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df[df['v'] > df['v'].mean()]"
+            $stdin | & $py $com -d ',' "df[df['v'] > df['v'].mean()]" --chunksize 2 | Should -Be $expected
+        }
+        It "fillna with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "x,y",
+                "1,",
+                "2,4",
+                "10,8",
+                ",20",
+                "3,"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.fillna(df.mean())"
+            $stdin | & $py $com -d ',' "df.fillna(df.mean())" --chunksize 2 | Should -Be $expected
+        }
+        It "assignment with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df['z']=df['v']-df['v'].mean();df"
+            $stdin | & $py $com -d ',' "df['z']=df['v']-df['v'].mean();df" --chunksize 2 | Should -Be $expected
+        }
+        It "row-wise assignment and sum is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,10",
+                "a,2",
+                "b,20",
+                "a,3"
+            )
+            $expected = $stdin | & $py $com -d ',' "df['z']=df.v*2;df.z.sum()"
+            $stdin | & $py $com -d ',' "df['z']=df.v*2;df.z.sum()" --chunksize 2 | Should -Be $expected
+        }
+        It "query with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,2",
+                "a,3",
+                "b,4"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.query('v > v.mean()')"
+            $stdin | & $py $com -d ',' "df.query('v > v.mean()')" --chunksize 2 | Should -Be $expected
+        }
+        It "assign lambda with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,2",
+                "a,3",
+                "b,4"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.assign(z=lambda d: d.v - d.v.mean())"
+            $stdin | & $py $com -d ',' "df.assign(z=lambda d: d.v - d.v.mean())" --chunksize 2 | Should -Be $expected
+        }
+        It "where lambda with mean is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,2",
+                "a,3",
+                "b,4"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.v.where(lambda s: s > s.mean())"
+            $stdin | & $py $com -d ',' "df.v.where(lambda s: s > s.mean())" --chunksize 2 | Should -Be $expected
+        }
+        It "label of a column is the same as whole input" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,1",
+                "b,2",
+                "a,3",
+                "b,4"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.v[3]"
+            $stdin | & $py $com -d ',' "df.v[3]" --chunksize 2 | Should -Be $expected
+        }
+    }
+    Context "when --jobs is given" {
+        It "np.where assignment is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' "df['z']=np.where(df.v>2,1,0);df"
+            $stdin | & $py $com -d ',' "df['z']=np.where(df.v>2,1,0);df" --jobs 3 | Should -Be $expected
+        }
+        It "groupby cumsum with index is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' --index "df.groupby('k').v.cumsum()"
+            $stdin | & $py $com -d ',' --index "df.groupby('k').v.cumsum()" --jobs 3 | Should -Be $expected
+        }
+        It "groupby value_counts is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.groupby('k').v.value_counts()"
+            $stdin | & $py $com -d ',' "df.groupby('k').v.value_counts()" --jobs 3 | Should -Be $expected
+        }
+        It "groupby apply sort_values is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.groupby('k').apply(lambda g: g.sort_values('v', ascending=False))"
+            $stdin | & $py $com -d ',' "df.groupby('k').apply(lambda g: g.sort_values('v', ascending=False))" --jobs 3 | Should -Be $expected
+        }
+        It "groupby ngroup is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.groupby('k').ngroup()"
+            $stdin | & $py $com -d ',' "df.groupby('k').ngroup()" --jobs 3 | Should -Be $expected
+        }
+        It "query with mean is the same as serial run" {
+            [string[]] $stdin  = @(
+                "id,k,v",
+                "5,b,1",
+                "3,a,2",
+                "9,b,3",
+                "1,a,4",
+                "7,c,5",
+                "2,b,3",
+                "4,a,1"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.query('v > v.mean()')"
+            $stdin | & $py $com -d ',' "df.query('v > v.mean()')" --jobs 3 | Should -Be $expected
+        }
+    }
+    Context "when --normalize is given" {
+        It "dtypes of ascii columns are the same as plain read" {
+            [string[]] $stdin  = @(
+                "flag,n,x,name",
+                "True,1,1.5,abc",
+                "False,2,,def",
+                "True,3,2.5,"
+            )
+            $expected = $stdin | & $py $com -d ',' "df.dtypes"
+            $stdin | & $py $com -d ',' "df.dtypes" --normalize | Should -Be $expected
+        }
+        It "full width digits become numbers" {
+            [string[]] $stdin  = @(
+                "k,v",
+                "a,１",
+                "b,２３"
+            )
+            [string[]] $stdout = @(
+                "24"
+            )
+            $stdin | & $py $com -d ',' "df.v.sum()" --normalize | Should -Be $stdout
+        }
+    }
+}
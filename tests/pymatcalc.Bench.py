@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#coding: utf-8
+
+#
+# pymatcalc.Bench - Benchmark pymatcalc.py and write a JSON report
+#
+
+import sys, os
+import re
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+_version = "Sat Oct 17 09:00:00 JST 2026"
+
+_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'pymatcalc.py')
+
+## benchmark cases: name -> (labels in input, pymatcalc args)
+##   parse:  read and echo only
+##   format: elementwise result (output formatting dominates)
+_CASES = {
+    'parse':      ('A',   ['-q', 'A']),
+    'matmul':     ('AB',  ['C=A@B']),
+    'inv':        ('A',   ['C=np.linalg.inv(A)']),
+    'solve':      ('AR',  ['X=np.linalg.solve(A, R)']),
+    'format':     ('A',   ['C=A/3']),
+    'format_fmt': ('A',   ['--fmt', '%.6g', 'C=A/3']),
+}
+
+## options used only when the benchmarked pymatcalc.py supports them,
+## so that older versions can be compared
+_OPT_PARSE_STATS = '--parse-stats'
+_OPT_THREADS     = '--threads'
+
+def raise_error(msg, *arg):
+    scriptfile = os.path.basename(__file__)
+    errorheader = "Error[" + scriptfile + "]:"
+    print(errorheader, msg.format(*arg), file=sys.stderr)
+    sys.exit(1)
+
+def get_args():
+    help_desc_msg = r"""pymatcalc.Bench - Benchmark pymatcalc.py
+
+    Generates matrices of several sizes, runs pymatcalc.py as a
+    subprocess for each case (parse, @, inv, solve, output formatting)
+    and writes the best wall time of the repeats to a JSON report.
+    Parse time is taken from --parse-stats. Runs offline.
+    Options the benchmarked script does not support (--parse-stats,
+    --threads, --fmt of older versions) are left out, and cases that
+    need them are skipped.
+
+    Compare two reports to catch regressions:
+        python pymatcalc.Bench.py --compare base.json new.json
+    """
+    help_epi_msg = r"""EXAMPLES:
+    python tests/pymatcalc.Bench.py -o base.json
+    python tests/pymatcalc.Bench.py --sizes 10,100 --repeat 5 -o new.json
+    python tests/pymatcalc.Bench.py --compare base.json new.json --threshold 0.2
+    """
+    parser = argparse.ArgumentParser(description=help_desc_msg,
+                    epilog=help_epi_msg,
+                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="JSON report file (default: stdout)", type=str)
+    parser.add_argument("--sizes", help="matrix sizes n (n x n)", default="10,100,1000,5000", type=str)
+    parser.add_argument("--cases", help="cases to run", default=",".join(_CASES), type=str)
+    parser.add_argument("--repeat", help="runs per case (best is reported)", default=3, type=int)
+    parser.add_argument("--threads", help="pass --threads N to pymatcalc.py", default=None, type=int)
+    parser.add_argument("--script", help="pymatcalc.py to benchmark", default=_script, type=str)
+    parser.add_argument("--compare", help="compare two reports: BASE NEW", nargs=2, type=str)
+    parser.add_argument("--threshold", help="slowdown ratio reported as regression", default=0.2, type=float)
+    parser.add_argument("-V", "--version", help="version", action="version", version=_version)
+    args = parser.parse_args()
+    return(args)
+
+def write_matrix(f, label, mat):
+    for row in mat.tolist():
+        f.write(label + ' ' + ' '.join(map(str, row)) + '\n')
+
+def make_input(dirname, size, labels, rng):
+    ## small integers keep the files small. A is diagonally dominant
+    ## so that inv and solve are well defined
+    filename = os.path.join(dirname, "input_{0}_{1}.txt".format(size, labels))
+    if os.path.exists(filename):
+        return filename
+    with open(filename, 'w', encoding='utf-8') as f:
+        for label in labels:
+            if label == 'R':
+                mat = rng.integers(0, 10, size=(size, 1))
+            else:
+                mat = rng.integers(0, 10, size=(size, size))
+                if label == 'A':
+                    mat += np.eye(size, dtype=mat.dtype) * 10 * size
+            write_matrix(f, label, mat)
+    return filename
+
+def get_script_options():
+    ## long options listed in the usage of the benchmarked script
+    proc = subprocess.run([sys.executable, args.script, '-h'],
+        stdin=subprocess.DEVNULL, capture_output=True)
+    if proc.returncode != 0:
+        raise_error("Could not run {0} -h: {1}", args.script, proc.stderr.decode('utf-8', 'replace').strip())
+    return set(re.findall(r'--[a-z][a-z-]*', proc.stdout.decode('utf-8', 'replace')))
+
+def is_supported(name, options):
+    return all(opt in options for opt in _CASES[name][1] if opt.startswith('--'))
+
+def run_case(name, size, filename, repeat, options):
+    cmd = [sys.executable, args.script]
+    if _OPT_PARSE_STATS in options:
+        cmd += [_OPT_PARSE_STATS]
+    if args.threads and _OPT_THREADS in options:
+        cmd += [_OPT_THREADS, str(args.threads)]
+    cmd += _CASES[name][1]
+    times = []
+    parse = []
+    for i in range(repeat):
+        with open(filename, 'rb') as stdin:
+            t = time.perf_counter()
+            proc = subprocess.run(cmd, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            times.append(time.perf_counter() - t)
+        stderr = proc.stderr.decode('utf-8', 'replace')
+        if proc.returncode != 0:
+            raise_error("{0} (n={1}) failed: {2}", name, size, stderr.strip())
+        m = re.search(r'in ([0-9.]+) s', stderr)
+        if m:
+            parse.append(float(m.group(1)))
+    return {'name': name, 'size': size, 'seconds': min(times), 'times': times,
+            'parse_seconds': min(parse) if parse else None,
+            'input_bytes': os.path.getsize(filename)}
+
+def get_meta():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            cwd=os.path.dirname(os.path.abspath(args.script))).stdout.decode().strip()
+    except OSError:
+        rev = ''
+    return {'script': os.path.abspath(args.script), 'git': rev,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'threads': args.threads}
+
+def run_bench():
+    sizes = [int(n) for n in args.sizes.split(',') if n]
+    cases = [c for c in args.cases.split(',') if c]
+    for name in cases:
+        if name not in _CASES:
+            raise_error("Unknown case: {0} (choose from {1})", name, ", ".join(_CASES))
+    options = get_script_options()
+    for name in [c for c in cases if not is_supported(c, options)]:
+        print("Skip {0}: not supported by {1}".format(name, args.script), file=sys.stderr)
+        cases.remove(name)
+    if args.threads and _OPT_THREADS not in options:
+        print("Warning: {0} is not supported by {1}".format(_OPT_THREADS, args.script), file=sys.stderr)
+    rng = np.random.default_rng(0)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pymatcalc-bench-') as dirname:
+        for size in sizes:
+            for name in cases:
+                filename = make_input(dirname, size, _CASES[name][0], rng)
+                result = run_case(name, size, filename, args.repeat, options)
+                print("{0:<12}{1:>6}{2:10.3f} s".format(name, size, result['seconds']), file=sys.stderr)
+                results.append(result)
+    report = json.dumps({'meta': get_meta(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+def load_report(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (OSError, ValueError) as e:
+        raise_error("Could not read report: {0}: {1}", filename, e)
+    return {(r['name'], r['size']): r for r in report['results']}
+
+def compare_reports(basefile, newfile):
+    ## print new/base ratios and return 1 if any case is slower than threshold
+    base = load_report(basefile)
+    new = load_report(newfile)
+    regressed = False
+    print("{0:<12}{1:>6}{2:>10}{3:>10}{4:>8}".format('case', 'size', 'base', 'new', 'ratio'))
+    for key in base:
+        if key not in new:
+            continue
+        b, n = base[key]['seconds'], new[key]['seconds']
+        ratio = n / b if b else float('inf')
+        mark = ''
+        if ratio > 1 + args.threshold:
+            mark = '  REGRESSION'
+            regressed = True
+        print("{0:<12}{1:>6}{2:10.3f}{3:10.3f}{4:8.2f}{5}".format(key[0], key[1], b, n, ratio, mark))
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.compare:
+        sys.exit(compare_reports(*args.compare))
+    run_bench()
+    sys.exit(0)
@@ -189,6 +189,170 @@ Describe "pymatcalc" {
             )
             $stdin | & $py $com 'C=A@(A@B)' | Should -Be $stdout
         }
+        It "calculate matrix: multiple formulas" {
+            [string[]] $stdin  = @(
+                "A 1 2",
+                "A 3 4",
+                "B 4 3",
+                "B 2 1"
+            )
+            [string[]] $stdout = @(
+                "A 1 2",
+                "A 3 4",
+                "B 4 3",
+                "B 2 1",
+                "C 8.0 5.0",
+                "C 20.0 13.0",
+                "D 48.0 31.0",
+                "D 104.0 67.0"
+            )
+            $stdin | & $py $com 'C=A@B; D=A@C' | Should -Be $stdout
+        }
+        It "calculate matrix: sparse" {
+            [string[]] $stdin  = @(
+                "A 0 0 4",
+                "A 0 1 1",
+                "A 1 0 1",
+                "A 1 1 3",
+                "A 2 2 0"
+            )
+            [string[]] $stdout = @(
+                "A 0 0 4",
+                "A 0 1 1",
+                "A 1 0 1",
+                "A 1 1 3",
+                "A 2 2 0",
+                "C 0 0 17.0",
+                "C 0 1 7.0",
+                "C 1 0 7.0",
+                "C 1 1 10.0",
+                "C 2 2 0"
+            )
+            $stdin | & $py $com --sparse 'C=A@A.T' | Should -Be $stdout
+        }
+        It "calculate matrix: batched groups" {
+            [string[]] $stdin  = @(
+                "1 L 1 1",
+                "1 L 2 4",
+                "1 R 9",
+                "1 R 22",
+                "2 L 2 0",
+                "2 L 0 4",
+                "2 R 2",
+                "2 R 8"
+            )
+            [string[]] $stdout = @(
+                "1 L 1 1",
+                "1 L 2 4",
+                "1 R 9",
+                "1 R 22",
+                "2 L 2 0",
+                "2 L 0 4",
+                "2 R 2",
+                "2 R 8",
+                "1 X 7.0",
+                "1 X 2.0",
+                "2 X 1.0",
+                "2 X 2.0"
+            )
+            $stdin | & $py $com -g 'X=np.linalg.solve(L, R)' | Should -Be $stdout
+        }
+        It "calculate matrix: batched groups transpose" {
+            [string[]] $stdin  = @(
+                "1 A 1 2",
+                "1 A 3 4",
+                "2 A 5 6",
+                "2 A 7 8",
+                "3 A 9 1",
+                "3 A 2 3"
+            )
+            [string[]] $stdout = @(
+                "1 A 1 2",
+                "1 A 3 4",
+                "2 A 5 6",
+                "2 A 7 8",
+                "3 A 9 1",
+                "3 A 2 3",
+                "1 C 1.0 3.0",
+                "1 C 2.0 4.0",
+                "2 C 5.0 7.0",
+                "2 C 6.0 8.0",
+                "3 C 9.0 2.0",
+                "3 C 1.0 3.0"
+            )
+            $stdin | & $py $com -g 'C=A.T' | Should -Be $stdout
+        }
+        It "calculate matrix: batched groups det" {
+            [string[]] $stdin  = @(
+                "1 A 2 0",
+                "1 A 0 3",
+                "2 A 1 2",
+                "2 A 3 4"
+            )
+            [string[]] $stdout = @(
+                "1 A 2 0",
+                "1 A 0 3",
+                "2 A 1 2",
+                "2 A 3 4",
+                "1 C 6.0",
+                "2 C -2.0000000000000004"
+            )
+            $stdin | & $py $com -g 'C=np.linalg.det(A)*np.eye(1)' | Should -Be $stdout
+        }
+        It "calculate matrix: tab delimiter" {
+            [string[]] $stdin  = @(
+                "A`t1`t2",
+                "A`t3`t4"
+            )
+            [string[]] $stdout = @(
+                "A`t1`t2",
+                "A`t3`t4",
+                "C`t1.0`t3.0",
+                "C`t2.0`t4.0"
+            )
+            $stdin | & $py $com -d '\t' 'C=A.T' | Should -Be $stdout
+        }
+        It "calculate matrix: output format" {
+            [string[]] $stdin  = @(
+                "A -4 2",
+                "A 7 2"
+            )
+            [string[]] $stdout = @(
+                "A -4 2",
+                "A 7 2",
+                "C -0.0909 0.0909",
+                "C 0.318 0.182"
+            )
+            $stdin | & $py $com --fmt '%.3g' 'C=np.linalg.inv(A)' | Should -Be $stdout
+        }
+        It "calculate matrix: --out npy and -i npy" {
+            [string[]] $stdin  = @(
+                "A 1 2",
+                "A 3 4",
+                "B 4 3",
+                "B 2 1"
+            )
+            [string[]] $stdout = @(
+                "D 16.0 10.0",
+                "D 40.0 26.0"
+            )
+            $stdin | & $py $com 'C=A@B' --out "$TestDrive/C.npy" | Should -Be $stdin
+            & $py $com -i "$TestDrive/C.npy" 'D=C*2' | Should -Be $stdout
+        }
+        It "calculate matrix: --out npz and -i npz" {
+            [string[]] $stdin  = @(
+                "A 1 2",
+                "A 3 4",
+                "B 4 3",
+                "B 2 1"
+            )
+            [string[]] $stdout = @(
+                "C 8.0 5.0",
+                "C 20.0 13.0"
+            )
+            $stdin | & $py $com 'X=A*1; Y=B*1' --out "$TestDrive/XY.npz" | Should -Be $stdin
+            & $py $com -i "$TestDrive/XY.npz" 'C=X@Y' | Should -Be $stdout
+        }
     }
 }
 